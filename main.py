@@ -6,13 +6,23 @@ from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import json
 import time
-import qrcode
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
 import io
 import os
 import calendar
+import threading
+import random
+from collections import deque
+import requests
+import sqlite3
+import hashlib
+import zipfile
+import shutil
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import qr_cards
 
 # ==========================================
 # [기본 설정] 페이지 및 스타일
@@ -75,6 +85,18 @@ st.markdown("""
 # ==========================================
 # [데이터베이스 엔진] 구글 시트 연동 핵심 함수 (수정됨)
 # ==========================================
+def get_config(key, default=None):
+    """
+    설정값 읽기: st.secrets -> 환경변수(ACADEMY_키) -> 기본값 순서
+    """
+    try:
+        if key in st.secrets: return st.secrets[key]
+    except Exception: pass
+    return os.environ.get(f"ACADEMY_{key.upper()}", default)
+
+# 저장소 백엔드: gspread(구글 시트, 기본) | sqlite(로컬 DB 파일) | memory(벤치마크용)
+STORAGE_BACKEND = str(get_config("storage_backend", "gspread")).lower()
+
 @st.cache_resource
 def init_connection():
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
@@ -89,132 +111,1283 @@ def init_connection():
     client = gspread.authorize(creds)
     return client
 
+# --- 핸들 레지스트리: 스프레드시트/워크시트 객체와 헤더(1행)를 메모리에 보관 ---
+@st.cache_resource
+def get_handle_registry():
+    # schema_versions: 시트 헤더(컬럼 순서)가 바뀔 때마다 1씩 증가
+    return {'spreadsheet': None, 'worksheets': {}, 'headers': {}, 'schema_versions': {}, 'lock': threading.RLock()}
+
+def get_spreadsheet():
+    """
+    Academy_DB 스프레드시트 핸들 (설정에 spreadsheet_key가 있으면 키로, 없으면 이름으로 한 번만 열기)
+    """
+    reg = get_handle_registry()
+    with reg['lock']:
+        if reg['spreadsheet'] is None:
+            client = init_connection()
+            key = get_config("spreadsheet_key")
+            if key: reg['spreadsheet'] = safe_api_call(client.open_by_key, key)
+            else: reg['spreadsheet'] = safe_api_call(client.open, "Academy_DB")
+        return reg['spreadsheet']
+
+def get_worksheet(sheet_name):
+    """
+    워크시트 핸들: 처음 한 번 전체 워크시트 목록을 받아두고, 없는 이름일 때만 다시 조회
+    """
+    reg = get_handle_registry()
+    with reg['lock']:
+        if sheet_name not in reg['worksheets']:
+            reg['worksheets'] = {ws.title: ws for ws in safe_api_call(get_spreadsheet().worksheets)}
+        if sheet_name not in reg['worksheets']:
+            raise gspread.exceptions.WorksheetNotFound(sheet_name)
+        return reg['worksheets'][sheet_name]
+
+def get_headers(sheet_name, required=(), refresh=False):
+    """
+    시트 헤더(1행) 캐시: required 컬럼이 헤더에 없으면(헤더 불일치) 한 번만 다시 읽어서 확인
+    """
+    reg = get_handle_registry()
+    headers = reg['headers'].get(sheet_name)
+    if refresh or headers is None or any(c not in headers for c in required):
+        headers = get_backend()['headers'](sheet_name)
+        _remember_headers(sheet_name, headers)
+    return headers
+
+def _remember_headers(sheet_name, headers):
+    reg = get_handle_registry()
+    with reg['lock']:
+        if reg['headers'].get(sheet_name) != list(headers):
+            reg['schema_versions'][sheet_name] = reg['schema_versions'].get(sheet_name, 0) + 1
+        reg['headers'][sheet_name] = list(headers)
+
+def get_schema_version(sheet_name):
+    return get_handle_registry()['schema_versions'].get(sheet_name, 0)
+
+# --- API 호출 스케줄러: 모든 세션이 공유하는 토큰 버킷 + 재시도 분류 ---
+# 구글 시트 읽기/쓰기 분당 한도 (기본 60회/분/사용자)
+SHEETS_QUOTA_PER_MIN = int(get_config("sheets_quota_per_min", 60))
+API_MAX_RETRIES = 5
+API_BACKOFF_CAP = 8.0 # 재시도 대기 최대 (초)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+@st.cache_resource
+def get_api_scheduler():
+    return {
+        'tokens': float(SHEETS_QUOTA_PER_MIN), 'updated': time.monotonic(), 'lock': threading.Lock(),
+        'recent': deque(), # 최근 1분간 호출 시각
+        'stats': {'calls': 0, 'retries': 0, 'throttled': 0, 'fatal': 0, 'wait_sec': 0.0},
+    }
+
+def _acquire_api_token():
+    """
+    토큰이 생길 때까지 대기 후 1개 사용 (분당 한도를 초당 속도로 나눠 채움)
+    """
+    sched = get_api_scheduler()
+    rate = SHEETS_QUOTA_PER_MIN / 60.0
+    while True:
+        with sched['lock']:
+            now = time.monotonic()
+            sched['tokens'] = min(float(SHEETS_QUOTA_PER_MIN), sched['tokens'] + (now - sched['updated']) * rate)
+            sched['updated'] = now
+            if sched['tokens'] >= 1:
+                sched['tokens'] -= 1
+                sched['stats']['calls'] += 1
+                sched['recent'].append(now)
+                while sched['recent'] and now - sched['recent'][0] > 60: sched['recent'].popleft()
+                return
+            wait = (1 - sched['tokens']) / rate
+            sched['stats']['throttled'] += 1
+            sched['stats']['wait_sec'] += wait
+        time.sleep(wait)
+
+def _error_status(e):
+    code = getattr(e, 'code', None)
+    if code is None and getattr(e, 'response', None) is not None: code = e.response.status_code
+    return code
+
+def _is_retryable(e):
+    # 한도 초과(429)/서버 오류(5xx)/네트워크 오류만 재시도, 나머지(권한, 잘못된 범위 등)는 즉시 실패
+    if isinstance(e, gspread.exceptions.APIError): return _error_status(e) in RETRYABLE_STATUS
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
 def safe_api_call(func, *args, **kwargs):
-    max_retries = 5
-    for i in range(max_retries):
+    sched = get_api_scheduler()
+    for i in range(API_MAX_RETRIES + 1):
+        _acquire_api_token()
         try:
             return func(*args, **kwargs)
-        except gspread.exceptions.APIError as e:
-            if "429" in str(e): 
-                time.sleep((1.5 ** i) + 1)
-                continue
-            else: raise e
         except Exception as e:
-            time.sleep(1)
-            continue
-    return func(*args, **kwargs)
+            if not _is_retryable(e) or i == API_MAX_RETRIES:
+                with sched['lock']: sched['stats']['fatal'] += 1
+                raise
+            # 지수 백오프 + 지터 (429면 다른 세션도 같이 쉬도록 버킷을 비움)
+            delay = random.uniform(0.5, 1.0) * min(API_BACKOFF_CAP, 2 ** i)
+            with sched['lock']:
+                if _error_status(e) == 429: sched['tokens'] = 0.0
+                sched['stats']['retries'] += 1
+                sched['stats']['wait_sec'] += delay
+            time.sleep(delay)
+
+def get_api_stats():
+    """
+    API 사용량 통계 (누적 호출/재시도/대기 시간, 최근 1분 호출 수)
+    """
+    sched = get_api_scheduler()
+    with sched['lock']:
+        now = time.monotonic()
+        last_min = sum(1 for t in sched['recent'] if now - t <= 60)
+        return dict(sched['stats'], last_min=last_min, quota=SHEETS_QUOTA_PER_MIN)
+
+# ==========================================
+# [캐시] 시트별 테이블 캐시 (쓰기 시 캐시를 직접 수정, 버전 카운터로 변경 감지)
+# ==========================================
+# 캐시된 시트가 이 시간(초)보다 오래되면 화면은 캐시로 그리고, 백그라운드에서 다시 읽어옴
+CACHE_MAX_AGE = float(get_config("cache_max_age", 60))
+
+@st.cache_resource
+def get_table_cache():
+    # tables: {시트명: {'df', 'loaded_at', 'refreshing'}}, versions: {시트명: 변경 횟수}
+    # derived: {인덱스 이름: (만들 때의 시트 버전들, 인덱스)}
+    return {'tables': {}, 'versions': {}, 'derived': {}, 'lock': threading.RLock()}
+
+def get_table_version(sheet_name):
+    """
+    시트 데이터가 바뀔 때마다 1씩 증가하는 버전 번호 (파생 인덱스 재계산 여부 판단용)
+    """
+    return get_table_cache()['versions'].get(sheet_name, 0)
+
+def get_derived(name, sheet_names, builder):
+    """
+    파생 인덱스 캐시: 관련 시트들의 버전이 그대로면 이전에 만든 결과를 재사용 (바뀌었을 때만 builder 실행)
+    """
+    cache = get_table_cache()
+    key = tuple(get_table_version(n) for n in sheet_names)
+    hit = cache['derived'].get(name)
+    if hit is not None and hit[0] == key: return hit[1]
+    value = builder()
+    cache['derived'][name] = (key, value)
+    return value
+
+def _values_to_df(values):
+    """
+    get_all_values 결과(1행=헤더)를 문자열 DataFrame으로 변환
+    """
+    if not values or not values[0]: return pd.DataFrame()
+    headers = values[0]
+    rows = [(r + [""] * len(headers))[:len(headers)] for r in values[1:]]
+    return pd.DataFrame(rows, columns=headers)
+
+def _fetch_tables(sheet_names, sh=None, seed_mirror=True):
+    """
+    여러 시트를 values_batch_get 한 번으로 읽어서 {시트명: DataFrame} 반환 (읽은 내용으로 미러도 교체)
+    """
+    sh = sh or get_spreadsheet()
+    res = safe_api_call(sh.values_batch_get, [f"'{name}'" for name in sheet_names])
+    tables = {}
+    for name, vr in zip(sheet_names, res.get('valueRanges', [])):
+        tables[name] = _values_to_df(vr.get('values', []))
+        if len(tables[name].columns): _remember_headers(name, tables[name].columns)
+        if seed_mirror: mirror_replace(name, tables[name])
+    return tables
+
+def _store_table(sheet_name, df, since_version=None, loaded_at=None):
+    cache = get_table_cache()
+    loaded_at = loaded_at or time.time()
+    with cache['lock']:
+        # 읽는 도중에 쓰기가 반영됐다면 (버전 변경) 읽어온 옛 데이터는 버림
+        if since_version is not None and cache['versions'].get(sheet_name, 0) != since_version: return
+        entry = cache['tables'].get(sheet_name)
+        # 내용이 그대로면 버전을 올리지 않음 -> 파생 인덱스 재사용
+        if entry is None or not entry['df'].equals(df):
+            cache['versions'][sheet_name] = cache['versions'].get(sheet_name, 0) + 1
+            cache['tables'][sheet_name] = {'df': df, 'loaded_at': loaded_at, 'refreshing': False}
+        else:
+            entry['loaded_at'] = loaded_at
+            entry['refreshing'] = False
+
+def _refresh_in_background(sheet_names):
+    cache = get_table_cache()
+    with cache['lock']:
+        entries = {n: cache['tables'][n] for n in sheet_names
+                   if n in cache['tables'] and not cache['tables'][n]['refreshing']}
+        if not entries: return
+        for entry in entries.values(): entry['refreshing'] = True
+        versions = {n: cache['versions'].get(n, 0) for n in entries}
+    backend = get_backend()
+
+    def worker():
+        try:
+            # 미러가 있는 시트는 바뀐 블록만 동기화한 뒤 미러에서 다시 읽음
+            mirrored = [n for n in entries if USE_MIRROR and n in MIRROR_SHEETS]
+            if mirrored:
+                sync_mirror(mirrored)
+                for name in mirrored:
+                    df, _ = mirror_read(name)
+                    if df is not None: _store_table(name, df, since_version=versions[name])
+            others = [n for n in entries if n not in mirrored]
+            if others:
+                for name, df in backend['read'](others).items():
+                    _store_table(name, df, since_version=versions[name])
+        except Exception as e:
+            if USE_MIRROR: get_mirror()['last_error'] = str(e)
+        finally:
+            with cache['lock']:
+                for entry in entries.values(): entry['refreshing'] = False
+
+    threading.Thread(target=worker, daemon=True).start()
+
+def load_snapshot(sheet_names, force=False, copy=True):
+    """
+    여러 시트를 한 번에 불러오기: 캐시에 없는 시트만 values_batch_get 한 번으로 읽어옴
+    force=True면 캐시와 상관없이 전체를 한 번에 다시 읽어서 같은 시점의 데이터로 맞춤
+    copy=False면 캐시된 DataFrame을 그대로 넘김 (읽기 전용으로만 사용)
+    """
+    cache = get_table_cache()
+    missing = list(sheet_names) if force else [n for n in sheet_names if n not in cache['tables']]
+    if missing and not force:
+        # 로컬 미러에 있으면 API 없이 바로 사용 (마지막 동기화 시각 기준으로 오래됐으면 아래에서 백그라운드 동기화)
+        for name in list(missing):
+            df, synced_at = mirror_read(name)
+            if df is not None:
+                _store_table(name, df, loaded_at=synced_at)
+                missing.remove(name)
+    if missing:
+        with cache['lock']: versions = {n: cache['versions'].get(n, 0) for n in missing}
+        try:
+            for name, df in get_backend()['read'](missing).items():
+                _store_table(name, df, since_version=None if force else versions[name])
+        except Exception:
+            # 일괄 조회 실패 시 (예: 없는 시트 포함) 시트별로 따로 읽음
+            for name in missing:
+                try: _store_table(name, get_backend()['read']([name])[name])
+                except Exception: pass
+
+    stale = [n for n in sheet_names if n in cache['tables']
+             and time.time() - cache['tables'][n]['loaded_at'] > CACHE_MAX_AGE]
+    if stale: _refresh_in_background(stale)
+
+    # 화면 코드에서 컬럼을 추가/수정하므로 기본은 복사본을 넘김
+    return {n: (cache['tables'][n]['df'].copy() if copy else cache['tables'][n]['df']) if n in cache['tables'] else pd.DataFrame()
+            for n in sheet_names}
 
-@st.cache_data(ttl=3)
 def load_data(sheet_name):
-    try:
-        client = init_connection()
-        sheet = safe_api_call(client.open("Academy_DB").worksheet, sheet_name)
-        data = safe_api_call(sheet.get_all_records)
-        return pd.DataFrame(data)
-    except: return pd.DataFrame()
+    return load_snapshot([sheet_name])[sheet_name]
+
+def clear_cache(sheet_name=None):
+    """
+    캐시 무효화: 시트명을 주면 해당 시트만, 없으면 전체
+    """
+    cache = get_table_cache()
+    with cache['lock']:
+        names = [sheet_name] if sheet_name else list(cache['tables'].keys())
+        for name in names:
+            if cache['tables'].pop(name, None) is not None:
+                cache['versions'][name] = cache['versions'].get(name, 0) + 1
+    for name in ([sheet_name] if sheet_name else PARTITION_COLS): invalidate_partitions(name)
+
+def _patch_table(sheet_name, patch_fn):
+    """
+    쓰기 성공 후 캐시된 DataFrame을 직접 수정 (patch_fn: df -> 새 df, 실패 시 None)
+    """
+    cache = get_table_cache()
+    with cache['lock']:
+        entry = cache['tables'].get(sheet_name)
+        if entry is None: return
+        new_df = patch_fn(entry['df'])
+        if new_df is None:
+            clear_cache(sheet_name)
+            return
+        entry['df'] = new_df
+        cache['versions'][sheet_name] = cache['versions'].get(sheet_name, 0) + 1
+
+def _cache_append(sheet_name, headers, rows):
+    def patch(df):
+        if df.empty and len(df.columns) == 0: df = pd.DataFrame(columns=headers)
+        if list(df.columns) != list(headers): return None
+        return pd.concat([df, pd.DataFrame(rows, columns=headers)], ignore_index=True)
+    since_version = get_table_version(sheet_name)
+    _patch_table(sheet_name, patch)
+    _partition_append(sheet_name, headers, rows)
+    _aggregate_append(sheet_name, headers, rows, since_version)
+
+def _cache_update(sheet_name, key_col, updates):
+    # key_col이 리스트면 여러 컬럼 조합 키 (key_val도 같은 순서의 튜플)
+    key_cols = [key_col] if isinstance(key_col, str) else list(key_col)
+    def patch(df):
+        if any(k not in df.columns for k in key_cols): return None
+        df = df.copy()
+        for key_val, new_data_dict in updates:
+            key_vals = [key_val] if isinstance(key_col, str) else list(key_val)
+            mask = pd.Series(True, index=df.index)
+            for k, v in zip(key_cols, key_vals): mask &= df[k] == str(v)
+            hits = df.index[mask]
+            if len(hits) == 0: return None
+            for k, v in new_data_dict.items():
+                if k in df.columns: df.at[hits[0], k] = str(v)
+        return df
+    _patch_table(sheet_name, patch)
+    invalidate_partitions(sheet_name)
+    invalidate_aggregates(sheet_name)
+
+def _cache_delete(sheet_name, criteria_dict):
+    def patch(df):
+        if any(k not in df.columns for k in criteria_dict): return None
+        mask = pd.Series(True, index=df.index)
+        for k, v in criteria_dict.items(): mask &= df[k] == str(v)
+        return df[~mask].reset_index(drop=True)
+    _patch_table(sheet_name, patch)
+    invalidate_partitions(sheet_name)
+    invalidate_aggregates(sheet_name)
+
+# --- 월별 조각(partition) 캐시: 날짜 컬럼 앞 7자리(YYYY-MM) 기준으로 필요한 달만 읽어옴 ---
+PARTITION_COLS = {'attendance': '날짜'} # 계속 쌓이기만 하는 시트 -> 나누는 기준 컬럼
+PARTITION_PREFETCH = int(get_config("partition_prefetch", 1)) # ◀/▶ 이동 대비 앞뒤로 미리 읽어둘 달 수
+
+@st.cache_resource
+def get_partition_cache():
+    # parts: {(시트명, 'YYYY-MM'): {'df', 'loaded_at', 'version'}}, loading: 백그라운드로 읽는 중인 조각
+    # gens: {시트명: 쓰기 횟수} (읽는 도중에 쓰기가 끼면 읽은 결과는 버림), index: {(시트, 달, 키 컬럼): (토큰, 인덱스)}
+    return {'parts': {}, 'loading': set(), 'gens': {}, 'index': {}, 'seq': 0, 'lock': threading.RLock()}
+
+def month_key(year, month, delta=0):
+    # (연, 월)에서 delta개월 이동한 달의 'YYYY-MM'
+    y, m = divmod(year * 12 + (month - 1) + delta, 12)
+    return f"{y}-{m + 1:02d}"
+
+def _prefix_upper(prefix):
+    # prefix로 시작하는 문자열의 상한 (예: '2026-10' -> '2026-11') -> 인덱스 범위 조회용
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _store_partition(sheet_name, part, df, since_gen=None, loaded_at=None):
+    pc = get_partition_cache()
+    with pc['lock']:
+        if since_gen is not None and pc['gens'].get(sheet_name, 0) != since_gen: return
+        pc['seq'] += 1
+        pc['parts'][(sheet_name, part)] = {'df': df, 'loaded_at': loaded_at or time.time(), 'version': pc['seq']}
+
+def invalidate_partitions(sheet_name):
+    if sheet_name not in PARTITION_COLS: return
+    pc = get_partition_cache()
+    with pc['lock']:
+        pc['gens'][sheet_name] = pc['gens'].get(sheet_name, 0) + 1
+        for key in [k for k in pc['parts'] if k[0] == sheet_name]: del pc['parts'][key]
+
+def _partition_append(sheet_name, headers, rows):
+    # 추가된 행을 해당 달 조각에 바로 반영 (읽어둔 조각만)
+    col = PARTITION_COLS.get(sheet_name)
+    if col is None: return
+    if col not in headers: return invalidate_partitions(sheet_name)
+    i = headers.index(col)
+    by_part = {}
+    for r in rows: by_part.setdefault(str(r[i])[:7], []).append(r)
+    pc = get_partition_cache()
+    with pc['lock']:
+        pc['gens'][sheet_name] = pc['gens'].get(sheet_name, 0) + 1
+        for part, part_rows in by_part.items():
+            entry = pc['parts'].get((sheet_name, part))
+            if entry is None: continue
+            if list(entry['df'].columns) != list(headers):
+                del pc['parts'][(sheet_name, part)]
+                continue
+            pc['seq'] += 1
+            entry['df'] = pd.concat([entry['df'], pd.DataFrame(part_rows, columns=headers)], ignore_index=True)
+            entry['version'] = pc['seq']
+
+def _load_partitions_in_background(sheet_name, parts):
+    pc = get_partition_cache()
+    with pc['lock']:
+        todo = [p for p in parts if (sheet_name, p) not in pc['loading']]
+        if not todo: return
+        pc['loading'].update((sheet_name, p) for p in todo)
+        gen = pc['gens'].get(sheet_name, 0)
+    backend = get_backend()
+    if backend['name'] == 'gspread': get_spreadsheet() # 스레드 밖에서 핸들을 먼저 열어둠
+
+    def worker():
+        try:
+            # 미러가 있으면 바뀐 블록만 동기화한 뒤 미러에서 해당 달만 조회
+            if USE_MIRROR and sheet_name in MIRROR_SHEETS: sync_mirror([sheet_name])
+            for p in todo:
+                _store_partition(sheet_name, p, backend['read_prefix'](sheet_name, PARTITION_COLS[sheet_name], p), since_gen=gen)
+        except Exception: pass
+        finally:
+            with pc['lock']: pc['loading'].difference_update((sheet_name, p) for p in todo)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+def load_partition(sheet_name, part):
+    """
+    시트의 한 달치(part='YYYY-MM') 행만 불러오기 -> (DataFrame 복사본, 변경 감지용 토큰)
+    전체 시트가 이미 캐시에 있으면 거기서 나눠 쓰고, 없으면 그 달만 백엔드에서 읽어옴 (오래되면 백그라운드 갱신)
+    """
+    col = PARTITION_COLS[sheet_name]
+    entry = get_table_cache()['tables'].get(sheet_name)
+    if entry is not None and col in entry['df'].columns:
+        df_all = entry['df']
+        parts = get_derived(f"partitions:{sheet_name}", [sheet_name],
+                            lambda: {k: g.reset_index(drop=True) for k, g in df_all.groupby(df_all[col].astype(str).str[:7])})
+        if time.time() - entry['loaded_at'] > CACHE_MAX_AGE: _refresh_in_background([sheet_name])
+        df = parts.get(part)
+        return (df.copy() if df is not None else pd.DataFrame(columns=df_all.columns)), ('table', get_table_version(sheet_name))
 
-def clear_cache(): st.cache_data.clear()
+    pc = get_partition_cache()
+    with pc['lock']:
+        p_entry = pc['parts'].get((sheet_name, part))
+        gen = pc['gens'].get(sheet_name, 0)
+    if p_entry is None:
+        df = get_backend()['read_prefix'](sheet_name, col, part)
+        # 미러에서 읽었으면 마지막 동기화 시각을 기준으로 오래됐는지 판단
+        _store_partition(sheet_name, part, df, since_gen=gen, loaded_at=mirror_synced_at(sheet_name))
+        with pc['lock']: p_entry = pc['parts'].get((sheet_name, part))
+        if p_entry is None: return df.copy(), None # 읽는 도중에 쓰기가 있었음 -> 이번 결과만 사용
+    if time.time() - p_entry['loaded_at'] > CACHE_MAX_AGE: _load_partitions_in_background(sheet_name, [part])
+    return p_entry['df'].copy(), ('part', p_entry['version'])
+
+def prefetch_partitions(sheet_name, parts):
+    """
+    아직 없는 달 조각만 백그라운드로 미리 읽어둠 (전체 시트가 캐시에 있으면 할 일 없음)
+    """
+    if sheet_name in get_table_cache()['tables']: return
+    pc = get_partition_cache()
+    with pc['lock']: missing = [p for p in parts if (sheet_name, p) not in pc['parts']]
+    if missing: _load_partitions_in_background(sheet_name, missing)
+
+def get_partition_index(sheet_name, part, key_col):
+    """
+    한 달치 행을 key_col(예: 학생) 기준으로 나눈 인덱스 {키: DataFrame} (조각이 바뀔 때만 다시 만듦)
+    """
+    df, token = load_partition(sheet_name, part)
+    pc = get_partition_cache()
+    hit = pc['index'].get((sheet_name, part, key_col))
+    if token is not None and hit is not None and hit[0] == token: return hit[1]
+    index = {k: g.reset_index(drop=True) for k, g in df.groupby(key_col)} if key_col in df.columns else {}
+    if token is not None: pc['index'][(sheet_name, part, key_col)] = (token, index)
+    return index
 
 def show_center_message(message, icon="✅"):
     placeholder = st.empty()
     placeholder.markdown(f'<div class="custom-alert"><span>{icon}</span> {message}</div>', unsafe_allow_html=True)
     time.sleep(1.2); placeholder.empty()
 
+# ==========================================
+# [미러] 로컬 SQLite 읽기 복제본 (Academy_DB 5개 시트) + 증분 동기화
+# ==========================================
+USE_MIRROR = STORAGE_BACKEND == "gspread" and str(get_config("use_mirror", "1")).lower() not in ("0", "false", "no")
+MIRROR_PATH = get_config("mirror_path", "academy_mirror.db")
+MIRROR_SHEETS = ['teachers', 'students', 'classes', 'enrollments', 'attendance']
+MIRROR_INDEX_COLS = {'이름', '학생', '반이름', '날짜'} # 학생/반/날짜 조회용 인덱스
+MIRROR_BLOCK_ROWS = 200 # 체크섬 블록 크기 (행)
+MIRROR_FULL_SYNC_EVERY = int(get_config("mirror_full_sync_every", 10)) # 시트별로 증분 동기화 N번마다 전체 비교
+
+@st.cache_resource
+def get_mirror():
+    conn = sqlite3.connect(MIRROR_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # passes: 마지막 전체 동기화 이후 증분 동기화 횟수 (시트별)
+    conn.execute("CREATE TABLE IF NOT EXISTS _sheet_meta (sheet TEXT PRIMARY KEY, headers TEXT NOT NULL, n_rows INTEGER NOT NULL, synced_at REAL NOT NULL, passes INTEGER NOT NULL DEFAULT 0)")
+    if "passes" not in [r[1] for r in conn.execute("PRAGMA table_info(_sheet_meta)")]:
+        conn.execute("ALTER TABLE _sheet_meta ADD COLUMN passes INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE TABLE IF NOT EXISTS _sync_meta (sheet TEXT NOT NULL, block INTEGER NOT NULL, checksum TEXT NOT NULL, PRIMARY KEY (sheet, block))")
+    # generation: 앱에서 쓰기가 반영될 때마다 증가 (동기화 도중 쓰기가 끼어들면 그 동기화 결과는 버림)
+    return {'conn': conn, 'lock': threading.RLock(), 'generation': 0, 'last_error': None}
+
+def _m_table(sheet_name):
+    return f'"m_{sheet_name}"'
+
+def _block_checksum(rows, n_cols):
+    # 블록 체크섬은 행 전체(헤더 칸 수에 맞춰 빈 칸 채움)로 계산 -> A열 밖의 칸만 바뀌어도 잡힘
+    return hashlib.sha1("\x1e".join("\x1f".join((list(r) + [""] * n_cols)[:n_cols]) for r in rows).encode()).hexdigest()
+
+def _mirror_meta(conn, sheet_name):
+    row = conn.execute("SELECT headers, n_rows, synced_at FROM _sheet_meta WHERE sheet=?", (sheet_name,)).fetchone()
+    return (json.loads(row[0]), row[1], row[2]) if row else (None, 0, 0.0)
+
+def _mirror_tx(fn):
+    """
+    미러 잠금 + 트랜잭션 안에서 fn(conn) 실행
+    """
+    m = get_mirror()
+    with m['lock']:
+        conn = m['conn']
+        conn.execute("BEGIN")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _mirror_reset(conn, sheet_name, headers):
+    t = _m_table(sheet_name)
+    conn.execute(f"DROP TABLE IF EXISTS {t}")
+    cols = "".join(f", c{i} TEXT" for i in range(len(headers)))
+    conn.execute(f"CREATE TABLE {t} (_row INTEGER NOT NULL{cols})")
+    conn.execute(f'CREATE INDEX "ix_{sheet_name}__row" ON {t} (_row)')
+    for i, h in enumerate(headers):
+        if h in MIRROR_INDEX_COLS: conn.execute(f'CREATE INDEX "ix_{sheet_name}_c{i}" ON {t} (c{i})')
+    conn.execute("DELETE FROM _sync_meta WHERE sheet=?", (sheet_name,))
+    conn.execute("INSERT OR REPLACE INTO _sheet_meta (sheet, headers, n_rows, synced_at, passes) VALUES (?, ?, 0, ?, 0)",
+                 (sheet_name, json.dumps(list(headers), ensure_ascii=False), time.time()))
+
+def _mirror_write_rows(conn, sheet_name, n_cols, start_row, rows):
+    # start_row(실제 시트 행 번호)부터 rows로 덮어씀
+    t = _m_table(sheet_name)
+    conn.execute(f"DELETE FROM {t} WHERE _row BETWEEN ? AND ?", (start_row, start_row + len(rows) - 1))
+    conn.executemany(f"INSERT INTO {t} VALUES ({', '.join('?' * (n_cols + 1))})",
+                     [[start_row + i] + (list(r) + [""] * n_cols)[:n_cols] for i, r in enumerate(rows)])
+
+def _mirror_set_n_rows(conn, sheet_name, n_rows):
+    conn.execute(f"DELETE FROM {_m_table(sheet_name)} WHERE _row > ?", (n_rows + 1,))
+    conn.execute("UPDATE _sheet_meta SET n_rows=?, synced_at=? WHERE sheet=?", (n_rows, time.time(), sheet_name))
+
+def _mirror_rechecksum(conn, sheet_name, from_row=2):
+    """
+    미러 내용으로 from_row가 속한 블록부터 끝까지 체크섬을 다시 계산 (앱에서 쓴 내용 = 시트 내용)
+    """
+    headers, n_rows, _ = _mirror_meta(conn, sheet_name)
+    first_block = max(from_row - 2, 0) // MIRROR_BLOCK_ROWS
+    conn.execute("DELETE FROM _sync_meta WHERE sheet=? AND block>=?", (sheet_name, first_block))
+    if not headers: return
+    start = 2 + first_block * MIRROR_BLOCK_ROWS
+    cols = ", ".join(f"c{i}" for i in range(len(headers)))
+    rows = conn.execute(f"SELECT {cols} FROM {_m_table(sheet_name)} WHERE _row>=? ORDER BY _row", (start,)).fetchall()
+    for i in range(0, len(rows), MIRROR_BLOCK_ROWS):
+        conn.execute("INSERT INTO _sync_meta VALUES (?, ?, ?)",
+                     (sheet_name, first_block + i // MIRROR_BLOCK_ROWS, _block_checksum(rows[i:i + MIRROR_BLOCK_ROWS], len(headers))))
+
+def mirror_replace(sheet_name, df):
+    """
+    시트 전체를 읽었을 때 미러 테이블을 통째로 교체
+    """
+    if not USE_MIRROR or sheet_name not in MIRROR_SHEETS or len(df.columns) == 0: return
+    def apply(conn):
+        _mirror_reset(conn, sheet_name, list(df.columns))
+        _mirror_write_rows(conn, sheet_name, len(df.columns), 2, df.values.tolist())
+        _mirror_set_n_rows(conn, sheet_name, len(df))
+        _mirror_rechecksum(conn, sheet_name)
+    _mirror_tx(apply)
+
+def mirror_read(sheet_name):
+    """
+    미러에서 시트 읽기 -> (DataFrame, 마지막 동기화 시각), 미러에 없으면 (None, 0)
+    """
+    if not USE_MIRROR or sheet_name not in MIRROR_SHEETS: return None, 0.0
+    m = get_mirror()
+    with m['lock']:
+        headers, _, synced_at = _mirror_meta(m['conn'], sheet_name)
+        if headers is None: return None, 0.0
+        cols = ", ".join(f"c{i}" for i in range(len(headers)))
+        rows = m['conn'].execute(f"SELECT {cols} FROM {_m_table(sheet_name)} ORDER BY _row").fetchall() if cols else []
+    return pd.DataFrame([list(r) for r in rows], columns=headers), synced_at
+
+def mirror_read_prefix(sheet_name, col, prefix):
+    """
+    미러에서 col 값이 prefix로 시작하는 행만 읽기 (날짜 등 인덱스 컬럼이면 범위 조회), 미러에 없으면 None
+    """
+    if not USE_MIRROR or sheet_name not in MIRROR_SHEETS: return None
+    m = get_mirror()
+    with m['lock']:
+        headers, _, _ = _mirror_meta(m['conn'], sheet_name)
+        if headers is None or col not in headers: return None
+        cols = ", ".join(f"c{i}" for i in range(len(headers)))
+        c = f"c{headers.index(col)}"
+        rows = m['conn'].execute(f"SELECT {cols} FROM {_m_table(sheet_name)} WHERE {c} >= ? AND {c} < ? ORDER BY _row",
+                                 (prefix, _prefix_upper(prefix))).fetchall()
+    return pd.DataFrame([list(r) for r in rows], columns=headers)
+
+def mirror_synced_at(sheet_name):
+    # 미러의 마지막 동기화 시각 (미러에 없으면 None)
+    if not USE_MIRROR or sheet_name not in MIRROR_SHEETS: return None
+    m = get_mirror()
+    with m['lock']: return _mirror_meta(m['conn'], sheet_name)[2] or None
+
+def mirror_query(sql, params=()):
+    """
+    미러에 직접 SQL 조회 (테이블: m_시트명, 컬럼: c0, c1, ... = 헤더 순서)
+    """
+    m = get_mirror()
+    with m['lock']: return m['conn'].execute(sql, params).fetchall()
+
+def _mirror_write_through(sheet_name, fn):
+    # 쓰기 반영 실패 시 해당 시트를 미러에서 지워서 다음 조회/동기화 때 새로 받게 함
+    if not USE_MIRROR or sheet_name not in MIRROR_SHEETS: return
+    m = get_mirror()
+    try:
+        with m['lock']:
+            m['generation'] += 1
+            headers, n_rows, _ = _mirror_meta(m['conn'], sheet_name)
+            if headers is None: return
+            _mirror_tx(lambda conn: fn(conn, headers, n_rows))
+    except Exception:
+        with m['lock']: m['conn'].execute("DELETE FROM _sheet_meta WHERE sheet=?", (sheet_name,))
+
+def mirror_append(sheet_name, headers, rows):
+    def apply(conn, m_headers, n_rows):
+        if list(m_headers) != list(headers): raise ValueError("header mismatch")
+        _mirror_write_rows(conn, sheet_name, len(headers), n_rows + 2, rows)
+        _mirror_set_n_rows(conn, sheet_name, n_rows + len(rows))
+        _mirror_rechecksum(conn, sheet_name, n_rows + 2)
+    _mirror_write_through(sheet_name, apply)
+
+def mirror_update_rows(sheet_name, row_updates):
+    """
+    row_updates: {실제 시트 행 번호: 수정할 dict}
+    """
+    def apply(conn, m_headers, n_rows):
+        for row_num, new_data_dict in row_updates.items():
+            sets = [(f"c{m_headers.index(k)}", str(v)) for k, v in new_data_dict.items() if k in m_headers]
+            if sets:
+                conn.execute(f"UPDATE {_m_table(sheet_name)} SET {', '.join(c + '=?' for c, _ in sets)} WHERE _row=?",
+                             [v for _, v in sets] + [row_num])
+        if row_updates: _mirror_rechecksum(conn, sheet_name, min(row_updates))
+    _mirror_write_through(sheet_name, apply)
+
+def mirror_delete_rows(sheet_name, row_nums):
+    def apply(conn, m_headers, n_rows):
+        t = _m_table(sheet_name)
+        # 아래쪽 구간부터 지우고 그 아래 행 번호를 당겨서 시트와 같은 번호를 유지
+        for s, e in reversed(_group_contiguous(row_nums)):
+            conn.execute(f"DELETE FROM {t} WHERE _row BETWEEN ? AND ?", (s, e))
+            conn.execute(f"UPDATE {t} SET _row = _row - ? WHERE _row > ?", (e - s + 1, e))
+        _mirror_set_n_rows(conn, sheet_name, n_rows - len(set(row_nums)))
+        if row_nums: _mirror_rechecksum(conn, sheet_name, min(row_nums))
+    _mirror_write_through(sheet_name, apply)
+
+def sync_mirror(sheet_names=None, full=False):
+    """
+    증분 동기화: 대상 시트를 values_batch_get 한 번으로 읽어 블록(행 전체)별 체크섬/행 수를 비교하고,
+    달라진 블록만 미러에 다시 씀 (어느 칸이 바뀌어도 다음 동기화에서 반영됨)
+    헤더가 바뀌었거나 시트마다 MIRROR_FULL_SYNC_EVERY번째 동기화면 미러 테이블을 통째로 다시 만듦
+    반환값: {시트명: 다시 쓴 행 수}
+    """
+    m = get_mirror()
+    sheet_names = [s for s in (sheet_names or MIRROR_SHEETS) if s in MIRROR_SHEETS]
+    if not sheet_names: return {}
+    with m['lock']:
+        generation = m['generation']
+        # 횟수는 시트별로 셈 (여러 시트 묶음이 번갈아 동기화돼도 시트마다 N번째에 전체 동기화)
+        m['conn'].executemany("UPDATE _sheet_meta SET passes = passes + 1 WHERE sheet=?", [(s,) for s in sheet_names])
+        passes = dict(m['conn'].execute(f"SELECT sheet, passes FROM _sheet_meta WHERE sheet IN ({', '.join('?' * len(sheet_names))})",
+                                        sheet_names).fetchall())
+        metas = {s: _mirror_meta(m['conn'], s) for s in sheet_names}
+        stored = {s: dict(m['conn'].execute("SELECT block, checksum FROM _sync_meta WHERE sheet=?", (s,)).fetchall())
+                  for s in sheet_names}
+    changed = {}
+
+    # 1. 대상 시트 전체를 한 번에 읽어서 달라진 블록 찾기
+    # (전체 동기화 결과가 버려지면(쓰기가 끼어듦) passes가 그대로 남아 다음 번에 다시 전체 동기화)
+    vrs = safe_api_call(get_spreadsheet().values_batch_get, [f"'{s}'" for s in sheet_names]).get('valueRanges', [])
+    plans, full_tables = [], {}
+    for s, vr in zip(sheet_names, vrs):
+        values = vr.get('values', [])
+        headers = values[0] if values else []
+        if (full or metas[s][0] is None or headers != metas[s][0]
+                or (MIRROR_FULL_SYNC_EVERY > 0 and passes.get(s, 0) >= MIRROR_FULL_SYNC_EVERY)):
+            full_tables[s] = _values_to_df(values)
+            continue
+        body = values[1:]
+        blocks = [(2 + b, body[b:b + MIRROR_BLOCK_ROWS]) for b in range(0, len(body), MIRROR_BLOCK_ROWS)
+                  if stored[s].get(b // MIRROR_BLOCK_ROWS) != _block_checksum(body[b:b + MIRROR_BLOCK_ROWS], len(headers))]
+        if blocks or len(body) != metas[s][1]: plans.append((s, headers, len(body), blocks))
+
+    # 3. 미러에 반영 (동기화 도중 앱에서 쓰기가 있었으면 이번 결과는 버리고 다음 동기화에 맡김)
+    def apply(conn):
+        if m['generation'] != generation: return
+        for s, headers, n_rows, blocks in plans:
+            for s_row, rows in blocks: _mirror_write_rows(conn, s, len(headers), s_row, rows)
+            _mirror_set_n_rows(conn, s, n_rows)
+            _mirror_rechecksum(conn, s, min([r for r, _ in blocks] + [n_rows + 2]))
+            changed[s] = sum(len(rows) for _, rows in blocks)
+        for s, df in full_tables.items():
+            if len(df.columns) == 0: continue
+            _mirror_reset(conn, s, list(df.columns))
+            _mirror_write_rows(conn, s, len(df.columns), 2, df.values.tolist())
+            _mirror_set_n_rows(conn, s, len(df))
+            _mirror_rechecksum(conn, s)
+            changed[s] = len(df)
+        for s in sheet_names:
+            conn.execute("UPDATE _sheet_meta SET synced_at=? WHERE sheet=?", (time.time(), s))
+    with m['lock']: _mirror_tx(apply)
+    return changed
+
+# ==========================================
+# [저장소 백엔드] gspread / sqlite / memory (설정 storage_backend로 선택)
+# ==========================================
+# 백엔드는 아래 기본 연산을 가진 dict (모든 값은 문자열, 행 id는 백엔드마다 다름 - 시트는 행 번호)
+#   read(시트명 목록) -> {시트명: DataFrame}        headers(시트명) -> 헤더 목록 (빈 시트면 [])
+#   append(시트명, 헤더, 행 목록, with_header)      -> 헤더 순서로 정렬된 행 추가 (with_header면 헤더도 새로 기록)
+#   find([(시트명, 헤더, 컬럼들), ...])            -> 대상별 [(행 id, 키 튜플), ...] (위에서부터 순서대로)
+#   update(시트명, 헤더, {행 id: 수정 dict}, raw)   delete({시트명: 행 id 집합})
+#   read_prefix(시트명, 컬럼, 접두어)              -> 컬럼 값이 접두어로 시작하는 행만 (월별 조각 읽기용)
+#   read_only (선택)                               -> True면 쓰기 연산이 모두 실패 (snapshot)
+# 시트별 컬럼(헤더 순서)과 타입: str 문자열 | category 반복되는 값(학년/강의실/과목/강사) | date 날짜
+# 로컬 백엔드(sqlite/memory)는 시트가 없으면 이 헤더로 빈 시트를 만들어 화면 코드가 그대로 동작함
+SHEET_SCHEMAS = {
+    'teachers': {'이름': 'str', '과목': 'category', '연락처': 'str', '이메일': 'str'},
+    'students': {'이름': 'str', '연락처': 'str', '학부모연락처': 'str', '학년': 'category', '학교': 'category'},
+    'classes': {'반이름': 'str', '선생님': 'category', '시간': 'str', '강의실': 'category'},
+    'enrollments': {'학생': 'str', '과목': 'category', '반이름': 'category', '담당강사': 'category', '날짜': 'date'},
+    'attendance': {'날짜': 'date', '반이름': 'category', '학생': 'str', '상태': 'category', '비고': 'str'},
+}
+SHEET_HEADERS = {name: list(cols) for name, cols in SHEET_SCHEMAS.items()}
+
+def _rows_in_header_order(headers, data_list):
+    # 헤더 순서대로 값을 정렬 (헤더에 없는 값은 무시, 데이터 없는 헤더는 빈칸)
+    return [[str(item.get(col, "")) for col in headers] for item in data_list]
+
+# --- gspread: 구글 시트 (API 스케줄러 + 로컬 미러 갱신) ---
+def _gs_headers(sheet_name):
+    return safe_api_call(get_worksheet(sheet_name).row_values, 1)
+
+def _gs_append(sheet_name, headers, rows, with_header=False):
+    ws = get_worksheet(sheet_name)
+    if with_header:
+        # 빈 시트: 헤더 + 데이터를 한 번에 전송
+        safe_api_call(ws.append_rows, [headers] + rows)
+        mirror_replace(sheet_name, pd.DataFrame(rows, columns=headers))
+        return
+    safe_api_call(ws.append_rows, rows)
+    mirror_append(sheet_name, headers, rows)
+
+def _read_columns(targets):
+    """
+    여러 시트의 지정 컬럼만 values_batch_get 한 번으로 읽기
+    targets: [(시트명, 헤더, [컬럼명...]), ...] -> 시트별 [열 값 목록, ...] (0번 값은 헤더)
+    """
+    ranges = []
+    for sheet_name, headers, cols in targets:
+        for k in cols:
+            col_letter = gspread.utils.rowcol_to_a1(1, headers.index(k) + 1)[:-1]
+            ranges.append(f"'{sheet_name}'!{col_letter}:{col_letter}")
+    res = safe_api_call(get_spreadsheet().values_batch_get, ranges, params={'majorDimension': 'COLUMNS'})
+    value_ranges = iter(res.get('valueRanges', []))
+    out = []
+    for _, _, cols in targets:
+        col_data = []
+        for _ in cols:
+            vals = next(value_ranges).get('values', [])
+            col_data.append(vals[0] if vals else [])
+        out.append(col_data)
+    return out
+
+def _iter_key_rows(col_data):
+    # 열 값 목록들을 (실제 시트 행 번호, 키 튜플)로 변환 (헤더 제외, 빈 칸은 "")
+    n_rows = max((len(c) for c in col_data), default=0)
+    for r in range(1, n_rows):
+        yield r + 1, tuple(c[r] if r < len(c) else "" for c in col_data)
+
+def _gs_find(targets):
+    return [list(_iter_key_rows(col_data)) for col_data in _read_columns(targets)]
+
+PARTITION_MAX_RANGES = 100 # 한 달치 행이 이보다 많은 구간으로 흩어져 있으면 처음~끝을 한 번에 읽고 거름
+
+def _gs_read_prefix(sheet_name, col, prefix):
+    # 미러에 있으면 로컬 인덱스로 바로 조회, 없으면 기준 컬럼만 읽고 해당 행 구간만 한 번에 읽어옴
+    df = mirror_read_prefix(sheet_name, col, prefix)
+    if df is not None: return df
+    headers = get_headers(sheet_name, required=[col])
+    if col not in headers: return pd.DataFrame()
+    rows = [r for r, (v,) in _gs_find([(sheet_name, headers, [col])])[0] if v.startswith(prefix)]
+    if not rows: return pd.DataFrame(columns=headers)
+    groups = _group_contiguous(rows)
+    if len(groups) > PARTITION_MAX_RANGES: groups = [(groups[0][0], groups[-1][1])]
+    last_col = gspread.utils.rowcol_to_a1(1, len(headers))[:-1]
+    res = safe_api_call(get_spreadsheet().values_batch_get, [f"'{sheet_name}'!A{s}:{last_col}{e}" for s, e in groups])
+    df = _values_to_df([headers] + [r for vr in res.get('valueRanges', []) for r in vr.get('values', [])])
+    return df[df[col].str.startswith(prefix)].reset_index(drop=True)
+
+def _row_update_ranges(headers, row_num, new_data_dict):
+    """
+    한 행의 수정 내용을 batch_update용 range 목록으로 변환 (연속된 열은 하나의 range로 묶음)
+    """
+    cols = sorted((headers.index(k) + 1, str(v)) for k, v in new_data_dict.items() if k in headers)
+    ranges = []
+    for col_idx, val in cols:
+        if ranges and ranges[-1]['end'] == col_idx - 1:
+            ranges[-1]['end'] = col_idx
+            ranges[-1]['values'][0].append(val)
+        else:
+            ranges.append({'start': col_idx, 'end': col_idx, 'values': [[val]]})
+    return [{
+        'range': f"{gspread.utils.rowcol_to_a1(row_num, r['start'])}:{gspread.utils.rowcol_to_a1(row_num, r['end'])}",
+        'values': r['values']
+    } for r in ranges]
+
+def _gs_update(sheet_name, headers, row_updates, raw=True):
+    # raw=True: 입력값 그대로(RAW), False: 시트에서 직접 입력한 것처럼 해석(USER_ENTERED)
+    batch = []
+    for row_num, new_data_dict in row_updates.items():
+        batch.extend(_row_update_ranges(headers, row_num, new_data_dict))
+    if batch: safe_api_call(get_worksheet(sheet_name).batch_update, batch, raw=raw)
+    mirror_update_rows(sheet_name, row_updates)
+
+def _group_contiguous(row_nums):
+    """
+    행 번호 목록을 연속 구간 [(시작, 끝), ...]으로 묶음 (예: 3,4,5,9 -> (3,5), (9,9))
+    """
+    groups = []
+    for r in sorted(set(row_nums)):
+        if groups and groups[-1][1] == r - 1: groups[-1][1] = r
+        else: groups.append([r, r])
+    return [tuple(g) for g in groups]
+
+def _gs_delete(rows_by_sheet):
+    delete_requests = []
+    for sheet_name, rows in rows_by_sheet.items():
+        # 같은 요청 안에서는 순서대로 적용되므로 아래쪽 구간부터 지워야 인덱스가 안 꼬임
+        for s, e in reversed(_group_contiguous(rows)):
+            delete_requests.append({'deleteDimension': {'range': {
+                'sheetId': get_worksheet(sheet_name).id, 'dimension': 'ROWS', 'startIndex': s - 1, 'endIndex': e
+            }}})
+    if not delete_requests: return
+    safe_api_call(get_spreadsheet().batch_update, {'requests': delete_requests})
+    for sheet_name, rows in rows_by_sheet.items(): mirror_delete_rows(sheet_name, rows)
+
+# --- sqlite: 로컬 DB 파일 (시트 = 테이블, 행 id = rowid) ---
+SQLITE_PATH = get_config("sqlite_path", "academy.db")
+
+@st.cache_resource
+def get_sqlite_store():
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return {'conn': conn, 'lock': threading.RLock()}
+
+def _sql_name(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _sql_headers_locked(conn, sheet_name, create=True):
+    headers = [r[1] for r in conn.execute(f"PRAGMA table_info({_sql_name(sheet_name)})")]
+    if not headers and create and sheet_name in SHEET_HEADERS:
+        headers = SHEET_HEADERS[sheet_name]
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {_sql_name(sheet_name)} ({', '.join(_sql_name(h) + ' TEXT' for h in headers)})")
+    return headers
+
+def _sql_headers(sheet_name):
+    store = get_sqlite_store()
+    with store['lock']: return _sql_headers_locked(store['conn'], sheet_name)
+
+def _sql_read(sheet_names):
+    store = get_sqlite_store()
+    tables = {}
+    with store['lock']:
+        for name in sheet_names:
+            headers = _sql_headers_locked(store['conn'], name)
+            if not headers:
+                tables[name] = pd.DataFrame()
+                continue
+            rows = store['conn'].execute(f"SELECT * FROM {_sql_name(name)} ORDER BY rowid").fetchall()
+            tables[name] = pd.DataFrame([["" if v is None else v for v in r] for r in rows], columns=headers)
+            _remember_headers(name, headers)
+    return tables
+
+def _sql_read_prefix(sheet_name, col, prefix):
+    store = get_sqlite_store()
+    with store['lock']:
+        conn = store['conn']
+        headers = _sql_headers_locked(conn, sheet_name)
+        if col not in headers: return pd.DataFrame(columns=headers)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {_sql_name("ix_" + sheet_name + "_" + col)} ON {_sql_name(sheet_name)} ({_sql_name(col)})')
+        rows = conn.execute(f"SELECT * FROM {_sql_name(sheet_name)} WHERE {_sql_name(col)} >= ? AND {_sql_name(col)} < ? ORDER BY rowid",
+                            (prefix, _prefix_upper(prefix))).fetchall()
+    return pd.DataFrame([["" if v is None else v for v in r] for r in rows], columns=headers)
+
+def _sql_tx(fn):
+    store = get_sqlite_store()
+    with store['lock']:
+        conn = store['conn']
+        conn.execute("BEGIN")
+        try:
+            fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _sql_append(sheet_name, headers, rows, with_header=False):
+    def apply(conn):
+        if with_header:
+            # 빈 시트에만 쓰이므로 헤더(컬럼)를 새로 정의
+            conn.execute(f"DROP TABLE IF EXISTS {_sql_name(sheet_name)}")
+            conn.execute(f"CREATE TABLE {_sql_name(sheet_name)} ({', '.join(_sql_name(h) + ' TEXT' for h in headers)})")
+        cols = ", ".join(_sql_name(h) for h in headers)
+        conn.executemany(f"INSERT INTO {_sql_name(sheet_name)} ({cols}) VALUES ({', '.join('?' * len(headers))})", rows)
+    _sql_tx(apply)
+
+def _sql_find(targets):
+    store = get_sqlite_store()
+    out = []
+    with store['lock']:
+        for sheet_name, _, cols in targets:
+            sql = f"SELECT rowid, {', '.join(_sql_name(c) for c in cols)} FROM {_sql_name(sheet_name)} ORDER BY rowid"
+            out.append([(r[0], tuple("" if v is None else v for v in r[1:])) for r in store['conn'].execute(sql)])
+    return out
+
+def _sql_update(sheet_name, headers, row_updates, raw=True):
+    def apply(conn):
+        for row_id, new_data_dict in row_updates.items():
+            cols = [k for k in new_data_dict if k in headers]
+            if not cols: continue
+            conn.execute(f"UPDATE {_sql_name(sheet_name)} SET {', '.join(_sql_name(k) + '=?' for k in cols)} WHERE rowid=?",
+                         [str(new_data_dict[k]) for k in cols] + [row_id])
+    _sql_tx(apply)
+
+def _sql_delete(rows_by_sheet):
+    def apply(conn):
+        for sheet_name, rows in rows_by_sheet.items():
+            conn.executemany(f"DELETE FROM {_sql_name(sheet_name)} WHERE rowid=?", [(r,) for r in rows])
+    _sql_tx(apply)
+
+# --- memory: 프로세스 메모리 (부하 테스트/벤치마크용, 재시작하면 사라짐) ---
+@st.cache_resource
+def get_memory_store():
+    # tables: {시트명: {'headers': [...], 'rows': {행 id: [값...]}, 'next_id': 다음 행 id}}
+    return {'tables': {}, 'lock': threading.RLock()}
+
+def _mem_table(sheet_name):
+    tables = get_memory_store()['tables']
+    if sheet_name not in tables:
+        tables[sheet_name] = {'headers': list(SHEET_HEADERS.get(sheet_name, [])), 'rows': {}, 'next_id': 2}
+    return tables[sheet_name]
+
+def _mem_headers(sheet_name):
+    with get_memory_store()['lock']: return list(_mem_table(sheet_name)['headers'])
+
+def _mem_read(sheet_names):
+    tables = {}
+    with get_memory_store()['lock']:
+        for name in sheet_names:
+            t = _mem_table(name)
+            tables[name] = pd.DataFrame(list(t['rows'].values()), columns=t['headers']) if t['headers'] else pd.DataFrame()
+            if t['headers']: _remember_headers(name, t['headers'])
+    return tables
+
+def _mem_read_prefix(sheet_name, col, prefix):
+    with get_memory_store()['lock']:
+        t = _mem_table(sheet_name)
+        if col not in t['headers']: return pd.DataFrame(columns=t['headers'])
+        i = t['headers'].index(col)
+        return pd.DataFrame([list(r) for r in t['rows'].values() if r[i].startswith(prefix)], columns=t['headers'])
+
+def _mem_append(sheet_name, headers, rows, with_header=False):
+    with get_memory_store()['lock']:
+        t = _mem_table(sheet_name)
+        if with_header: t['headers'] = list(headers)
+        for row in rows:
+            t['rows'][t['next_id']] = list(row)
+            t['next_id'] += 1
+
+def _mem_find(targets):
+    out = []
+    with get_memory_store()['lock']:
+        for sheet_name, _, cols in targets:
+            t = _mem_table(sheet_name)
+            idx = [t['headers'].index(c) for c in cols]
+            out.append([(row_id, tuple(row[i] for i in idx)) for row_id, row in t['rows'].items()])
+    return out
+
+def _mem_update(sheet_name, headers, row_updates, raw=True):
+    with get_memory_store()['lock']:
+        t = _mem_table(sheet_name)
+        for row_id, new_data_dict in row_updates.items():
+            row = t['rows'].get(row_id)
+            if row is None: continue
+            for k, v in new_data_dict.items():
+                if k in t['headers']: row[t['headers'].index(k)] = str(v)
+
+def _mem_delete(rows_by_sheet):
+    with get_memory_store()['lock']:
+        for sheet_name, rows in rows_by_sheet.items():
+            t = _mem_table(sheet_name)
+            for row_id in rows: t['rows'].pop(row_id, None)
+
+# --- snapshot: 내보낸 Parquet/CSV 스냅샷 디렉터리 (오프라인 분석용, 읽기 전용) ---
+SNAPSHOT_DIR = get_config("snapshot_dir", "snapshots")
+SNAPSHOT_PATH = get_config("snapshot_path", "") # 비우면 snapshot_dir에서 가장 최근 스냅샷
+SNAPSHOT_FORMATS = ('parquet', 'csv')
+
+def _compact_frame(sheet_name, df):
+    """
+    문자열 프레임 -> Parquet용 작은 dtype (스키마의 category 컬럼은 사전 인코딩, 날짜는 전부 YYYY-MM-DD일 때만 datetime)
+    """
+    out = df.copy()
+    for col, kind in SHEET_SCHEMAS.get(sheet_name, {}).items():
+        if col not in out.columns: continue
+        s = out[col].astype(str)
+        if kind == 'category': out[col] = s.astype('category')
+        elif kind == 'date':
+            parsed = pd.to_datetime(s, format='%Y-%m-%d', errors='coerce')
+            # 빈 칸 말고 못 읽는 값이 하나라도 있으면 문자열 그대로 (되돌릴 때 원래 값이 바뀌지 않게)
+            if ((parsed.isna() == (s == "")) & s.str.len().isin([0, 10])).all(): out[col] = parsed
+    return out
+
+def _restore_frame(df):
+    # 스냅샷에서 읽은 프레임 -> 앱이 쓰는 문자열 프레임
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        out[col] = s.dt.strftime('%Y-%m-%d').fillna("") if pd.api.types.is_datetime64_any_dtype(s) else s.astype(str)
+    return pd.DataFrame(out).reset_index(drop=True)
+
+def export_snapshot(fmt='parquet', sheet_names=tuple(SHEET_HEADERS), base_dir=None):
+    """
+    모든 시트를 한 번에 읽어 (gspread면 values_batch_get 1번) 시각별 디렉터리에 시트마다 파일 하나로 저장 -> 디렉터리 경로
+    임시 디렉터리에 다 쓰고 manifest.json까지 만든 뒤 이름을 바꾸므로, 중간에 실패한 스냅샷은 목록에 나오지 않음
+    (실패하면 임시 디렉터리도 지움)
+    """
+    if fmt not in SNAPSHOT_FORMATS: raise ValueError(f"지원하지 않는 형식입니다: {fmt}")
+    base_dir = base_dir or SNAPSHOT_DIR
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    final_dir, n = os.path.join(base_dir, stamp), 1
+    while os.path.exists(final_dir): # 같은 초에 두 번 내보낸 경우
+        n += 1; final_dir = os.path.join(base_dir, f"{stamp}-{n}")
+    tmp_dir = os.path.join(base_dir, f".tmp-{os.path.basename(final_dir)}")
+    shutil.rmtree(tmp_dir, ignore_errors=True) # 예전에 프로세스가 죽으며 남긴 같은 이름의 임시 디렉터리
+    os.makedirs(tmp_dir)
+    try:
+        tables = load_snapshot(list(sheet_names), force=True, copy=False)
+        manifest = {'created_at': datetime.now().isoformat(timespec='seconds'), 'source': STORAGE_BACKEND, 'format': fmt, 'sheets': {}}
+        for name, df in tables.items():
+            if len(df.columns) == 0: continue
+            file_name = f"{name}.{fmt}"
+            if fmt == 'parquet': _compact_frame(name, df).to_parquet(os.path.join(tmp_dir, file_name), index=False)
+            else: df.to_csv(os.path.join(tmp_dir, file_name), index=False, encoding="utf-8-sig")
+            manifest['sheets'][name] = {'file': file_name, 'rows': len(df), 'headers': list(df.columns)}
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return final_dir
+
+def list_snapshots(base_dir=None):
+    """
+    완성된 스냅샷 목록 (최신순) -> [{'path', 'created_at', 'source', 'format', 'sheets'}, ...]
+    """
+    base_dir = base_dir or SNAPSHOT_DIR
+    if not os.path.isdir(base_dir): return []
+    found = []
+    for entry in sorted(os.listdir(base_dir), reverse=True):
+        manifest_path = os.path.join(base_dir, entry, "manifest.json")
+        if entry.startswith(".") or not os.path.exists(manifest_path): continue
+        with open(manifest_path, encoding="utf-8") as f: found.append({'path': os.path.join(base_dir, entry), **json.load(f)})
+    return found
+
+def read_snapshot_dir(path):
+    """
+    스냅샷 디렉터리 -> (manifest, {시트명: 문자열 DataFrame}) (시트 헤더 순서 그대로)
+    """
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f: manifest = json.load(f)
+    tables = {}
+    for name, info in manifest['sheets'].items():
+        file_path = os.path.join(path, info['file'])
+        if file_path.endswith(".parquet"): df = pd.read_parquet(file_path)
+        else: df = pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+        tables[name] = _restore_frame(df)[info['headers']]
+    return manifest, tables
+
+def snapshot_zip(path):
+    # 스냅샷 디렉터리 -> ZIP bytes (다운로드용)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for file_name in sorted(os.listdir(path)): zf.write(os.path.join(path, file_name), file_name)
+    return buf.getvalue()
+
+@st.cache_resource
+def get_snapshot_store():
+    # snapshot 백엔드가 보는 스냅샷 (프로세스당 한 번만 읽어 메모리에 둠)
+    path = SNAPSHOT_PATH or next((s['path'] for s in list_snapshots()), None)
+    if not path: return {'path': None, 'manifest': {}, 'tables': {}}
+    manifest, tables = read_snapshot_dir(path)
+    return {'path': path, 'manifest': manifest, 'tables': tables}
+
+def _snap_table(sheet_name):
+    return get_snapshot_store()['tables'].get(sheet_name, pd.DataFrame())
+
+def _snap_headers(sheet_name):
+    return list(_snap_table(sheet_name).columns)
+
+def _snap_read(sheet_names):
+    tables = {}
+    for name in sheet_names:
+        tables[name] = _snap_table(name).copy()
+        if len(tables[name].columns): _remember_headers(name, list(tables[name].columns))
+    return tables
+
+def _snap_read_prefix(sheet_name, col, prefix):
+    df = _snap_table(sheet_name)
+    if col not in df.columns: return pd.DataFrame(columns=df.columns)
+    return df[df[col].str.startswith(prefix)].reset_index(drop=True)
+
+def _snap_read_only(*args, **kwargs):
+    raise PermissionError("스냅샷은 읽기 전용입니다 (저장하려면 storage_backend를 바꿔주세요)")
+
+STORAGE_BACKENDS = {
+    'gspread': {'name': 'gspread', 'read': _fetch_tables, 'headers': _gs_headers, 'append': _gs_append,
+                'find': _gs_find, 'update': _gs_update, 'delete': _gs_delete, 'read_prefix': _gs_read_prefix},
+    'sqlite': {'name': 'sqlite', 'read': _sql_read, 'headers': _sql_headers, 'append': _sql_append,
+               'find': _sql_find, 'update': _sql_update, 'delete': _sql_delete, 'read_prefix': _sql_read_prefix},
+    'memory': {'name': 'memory', 'read': _mem_read, 'headers': _mem_headers, 'append': _mem_append,
+               'find': _mem_find, 'update': _mem_update, 'delete': _mem_delete, 'read_prefix': _mem_read_prefix},
+    'snapshot': {'name': 'snapshot', 'read_only': True, 'read': _snap_read, 'headers': _snap_headers, 'append': _snap_read_only,
+                 'find': _snap_read_only, 'update': _snap_read_only, 'delete': _snap_read_only, 'read_prefix': _snap_read_prefix},
+}
+if STORAGE_BACKEND not in STORAGE_BACKENDS:
+    st.error(f"알 수 없는 저장소 백엔드입니다: {STORAGE_BACKEND} ({', '.join(STORAGE_BACKENDS)} 중 하나로 설정하세요)")
+    st.stop()
+
+def get_backend(name=None):
+    """
+    현재 저장소 백엔드 (설정 storage_backend: gspread | sqlite | memory | snapshot)
+    """
+    return STORAGE_BACKENDS[name or STORAGE_BACKEND]
+
+def copy_tables(source, target, sheet_names=tuple(SHEET_HEADERS)):
+    """
+    백엔드 간 시트 복사 (예: 운영 시트 -> memory로 옮겨 부하 테스트, gspread -> sqlite 이전)
+    대상 시트는 비어 있어야 함. 반환값: {시트명: 복사한 행 수}
+    """
+    src, dst = get_backend(source), get_backend(target)
+    copied = {}
+    for name, df in src['read'](list(sheet_names)).items():
+        if len(df.columns) == 0: continue
+        headers, dst_headers = list(df.columns), dst['headers'](name)
+        if dst_headers and dst['find']([(name, dst_headers, dst_headers[:1])])[0]:
+            raise ValueError(f"'{name}' 시트가 비어 있지 않습니다 ({target})")
+        if dst_headers and dst_headers != headers and dst['name'] == 'gspread':
+            raise ValueError(f"'{name}' 시트의 헤더가 다릅니다 ({target})")
+        dst['append'](name, headers, df.values.tolist(), with_header=dst_headers != headers)
+        copied[name] = len(df)
+    if target == STORAGE_BACKEND:
+        for name in copied:
+            get_headers(name, refresh=True)
+            clear_cache(name)
+    return copied
+
+# ==========================================
+# [데이터 쓰기] 추가/수정/삭제 (백엔드 공통: 헤더 순서 정렬 + 캐시 반영)
+# ==========================================
 # --- [핵심 수정] 데이터 입력/수정/삭제 로직 강화 ---
-# 이제 헤더(1행)를 읽어서 정확한 위치에 데이터를 꽂아넣습니다.
+# 헤더(1행) 순서에 맞춰 정확한 위치에 데이터를 꽂아넣습니다. (헤더는 레지스트리에 캐시)
+
+def _append_records(sheet_name, data_list):
+    """
+    캐시된 헤더 순서로 행을 만들어 한 번에 추가 (실패 시 헤더를 다시 확인하고 한 번 재시도)
+    """
+    backend = get_backend()
+    schema_ver = get_schema_version(sheet_name)
+    headers = get_headers(sheet_name)
+
+    # 데이터가 하나도 없는 빈 시트라면, 딕셔너리 키를 헤더로 씁니다. (헤더 + 데이터를 한 번에 전송)
+    if not headers:
+        headers = list(data_list[0].keys())
+        rows_to_add = _rows_in_header_order(headers, data_list)
+        backend['append'](sheet_name, headers, rows_to_add, with_header=True)
+        _remember_headers(sheet_name, headers)
+        _cache_append(sheet_name, headers, rows_to_add)
+        return
+
+    rows_to_add = _rows_in_header_order(headers, data_list)
+    try:
+        backend['append'](sheet_name, headers, rows_to_add)
+    except Exception:
+        # 추가 실패 시에만 실제 시트 헤더와 비교 -> 스키마가 바뀌었으면 새 순서로 재시도
+        get_headers(sheet_name, refresh=True)
+        if get_schema_version(sheet_name) == schema_ver: raise
+        headers = get_headers(sheet_name)
+        rows_to_add = _rows_in_header_order(headers, data_list)
+        backend['append'](sheet_name, headers, rows_to_add)
+    _cache_append(sheet_name, headers, rows_to_add)
 
 def add_data(sheet_name, data_dict):
     """
-    데이터 추가 함수: 시트의 헤더를 읽어 순서에 맞게 데이터를 정렬하여 추가함
+    데이터 추가 함수: 시트의 헤더 순서에 맞게 데이터를 정렬하여 추가함
     """
     try:
-        client = init_connection()
-        ws = safe_api_call(client.open("Academy_DB").worksheet, sheet_name)
-        
-        # 1. 시트의 헤더(1행) 가져오기
-        headers = safe_api_call(ws.row_values, 1)
-        
-        # 2. 데이터가 하나도 없는 빈 시트라면, 딕셔너리 키를 헤더로 씁니다.
-        if not headers:
-            safe_api_call(ws.append_row, list(data_dict.keys()))
-            headers = list(data_dict.keys())
-            
-        # 3. 헤더 순서대로 값을 정렬 (헤더에 없는 값은 무시, 데이터 없는 헤더는 빈칸)
-        row_to_add = []
-        for col_name in headers:
-            row_to_add.append(str(data_dict.get(col_name, "")))
-            
-        # 4. 시트에 추가
-        safe_api_call(ws.append_row, row_to_add)
-        clear_cache()
+        _append_records(sheet_name, [data_dict])
         return True
     except Exception as e:
         st.error(f"데이터 추가 실패: {e}")
         return False
 
-def add_data_bulk(sheet_name, data_list):
+def add_data_bulk(sheet_name, data_list, upsert_keys=None):
     """
     여러 건 데이터 추가 (수강 배정 등)
+    upsert_keys를 주면 같은 키(예: 날짜+반이름+학생)의 기존 행은 덮어쓰고, 나머지만 추가함
     """
-    if not data_list: return
+    if not data_list: return True
     try:
-        client = init_connection()
-        ws = safe_api_call(client.open("Academy_DB").worksheet, sheet_name)
-        headers = safe_api_call(ws.row_values, 1)
-        
-        if not headers:
-            headers = list(data_list[0].keys())
-            safe_api_call(ws.append_row, headers)
-            
-        rows_to_add = []
-        for item in data_list:
-            row = []
-            for col in headers:
-                row.append(str(item.get(col, "")))
-            rows_to_add.append(row)
-            
-        safe_api_call(ws.append_rows, rows_to_add)
-        clear_cache()
+        if upsert_keys: data_list = _upsert_existing(sheet_name, data_list, upsert_keys)
+        if data_list: _append_records(sheet_name, data_list)
+        return True
     except Exception as e:
         st.error(f"일괄 추가 실패: {e}")
+        return False
+
+def _upsert_existing(sheet_name, data_list, upsert_keys):
+    """
+    키가 같은 기존 행은 한 번에 덮어쓰고, 새로 추가해야 할 행만 돌려줌
+    """
+    def key_of(item): return tuple(str(item.get(k, "")) for k in upsert_keys)
+
+    # 캐시는 다른 프로세스/키오스크 대기열의 쓰기를 모를 수 있으므로 항상 시트의 키 컬럼을 읽고 판단
+    backend = get_backend()
+    headers = get_headers(sheet_name, required=upsert_keys)
+    if not headers or any(k not in headers for k in upsert_keys): return data_list
+    row_map = {}
+    for row_id, key in backend['find']([(sheet_name, headers, upsert_keys)])[0]:
+        row_map.setdefault(key, row_id)
+
+    updated, remaining, row_updates = [], [], {}
+    for item in data_list:
+        row_id = row_map.get(key_of(item))
+        if row_id is None:
+            remaining.append(item)
+        else:
+            updated.append((key_of(item), item))
+            row_updates[row_id] = item
+    if row_updates:
+        # 추가(append)와 같은 RAW 입력으로 덮어써야 날짜 등의 형식이 그대로 유지됨
+        backend['update'](sheet_name, headers, row_updates, raw=True)
+        _cache_update(sheet_name, upsert_keys, updated)
+    return remaining
 
 def update_data(sheet_name, key_col, key_val, new_data_dict):
     """
     데이터 수정 함수: 키값(예: 이름)으로 행을 찾아서 해당 셀만 업데이트
     """
+    return update_data_bulk(sheet_name, key_col, [(key_val, new_data_dict)])
+
+def update_data_bulk(sheet_name, key_col, updates):
+    """
+    여러 건 데이터 수정: [(키값, 수정할 dict), ...]를 한 번의 요청으로 반영
+    """
+    if not updates: return True
     try:
-        client = init_connection()
-        ws = safe_api_call(client.open("Academy_DB").worksheet, sheet_name)
-        
-        # 1. 전체 데이터 가져와서 DataFrame으로 변환 (위치 찾기용)
-        data = safe_api_call(ws.get_all_records)
-        df = pd.DataFrame(data)
-        
-        # 2. 수정할 행(Index) 찾기
-        # 데이터프레임 인덱스 찾기
-        target_indices = df[df[key_col].astype(str) == str(key_val)].index
-        
-        if len(target_indices) == 0:
-            st.error("수정할 데이터를 찾을 수 없습니다.")
+        backend = get_backend()
+        headers = get_headers(sheet_name, required=[key_col])
+        if key_col not in headers:
+            st.error(f"수정할 데이터를 찾을 수 없습니다: {key_col} 컬럼 없음")
             return False
-            
-        # 구글 시트는 1부터 시작 + 헤더 1줄 = (idx + 2)가 실제 행 번호
-        row_num = target_indices[0] + 2
-        
-        # 3. 헤더 가져오기 (열 번호 찾기용)
-        headers = safe_api_call(ws.row_values, 1)
-        
-        # 4. 수정할 데이터만 업데이트
-        # 배치 업데이트를 위한 셀 목록 생성
-        cells_to_update = []
-        for col_name, new_val in new_data_dict.items():
-            if col_name in headers:
-                col_idx = headers.index(col_name) + 1 # 1부터 시작
-                # update_cell을 쓰면 느리므로, range update 방식을 권장하지만
-                # 여기서는 안전하게 개별 셀 업데이트 사용 (속도 이슈 시 변경 가능)
-                safe_api_call(ws.update_cell, row_num, col_idx, str(new_val))
-                
-        clear_cache()
+
+        # 1. 키 컬럼만 읽어서 수정할 행 찾기 (전체 시트를 읽지 않음, 같은 키는 첫 번째 행)
+        wanted = {str(k) for k, _ in updates}
+        row_map = {}
+        for row_id, (v,) in backend['find']([(sheet_name, headers, [key_col])])[0]:
+            if v in wanted: row_map.setdefault(v, row_id)
+        missing = [str(k) for k, _ in updates if str(k) not in row_map]
+        if missing:
+            st.error(f"수정할 데이터를 찾을 수 없습니다: {', '.join(missing)}")
+            return False
+
+        # 2. 모든 행의 변경 내용을 모아서 한 번에 전송
+        row_updates = {}
+        for k, new_data_dict in updates:
+            row_updates.setdefault(row_map[str(k)], {}).update(new_data_dict)
+        backend['update'](sheet_name, headers, row_updates, raw=False)
+
+        _cache_update(sheet_name, key_col, updates)
         return True
     except Exception as e:
         st.error(f"수정 실패: {e}")
@@ -222,33 +1395,162 @@ def update_data(sheet_name, key_col, key_val, new_data_dict):
 
 def delete_data_all(sheet_name, criteria_dict):
     """
-    데이터 삭제 함수
+    데이터 삭제 함수: 조건에 맞는 모든 행을 한 번에 삭제
+    """
+    deleted = delete_cascade([(sheet_name, criteria_dict)])
+    return bool(deleted and deleted.get(sheet_name))
+
+def delete_cascade(plan):
+    """
+    여러 시트에 걸친 연쇄 삭제: [(시트명, 조건 dict), ...]
+    예) 학생 삭제 시 [('students', {'이름': 홍길동}), ('enrollments', {'학생': 홍길동})]
+    조건 컬럼만 한 번에 읽고, 모든 시트의 삭제를 한 번에 반영함
+    반환값: {시트명: 삭제된 행 수}
     """
     try:
-        client = init_connection()
-        ws = safe_api_call(client.open("Academy_DB").worksheet, sheet_name)
-        data = safe_api_call(ws.get_all_records)
-        
-        # 삭제할 행 번호들 수집 (역순으로 삭제해야 인덱스 안 꼬임)
-        rows_to_delete = []
-        for i, row in enumerate(data):
-            match = True
-            for k, v in criteria_dict.items():
-                if str(row.get(k)) != str(v):
-                    match = False
-                    break
-            if match:
-                rows_to_delete.append(i + 2) # 헤더 고려
-        
-        if rows_to_delete:
-            for r in sorted(rows_to_delete, reverse=True):
-                safe_api_call(ws.delete_rows, r)
-            clear_cache()
-            return True
-        return False
+        backend = get_backend()
+        # 1. 시트별 헤더 확인 (조건 컬럼이 없는 시트는 삭제할 행이 없음)
+        targets, criteria_list = [], []
+        for sheet_name, criteria_dict in plan:
+            headers = get_headers(sheet_name, required=criteria_dict)
+            if not criteria_dict or any(k not in headers for k in criteria_dict): continue
+            cols = list(criteria_dict.keys())
+            targets.append((sheet_name, headers, cols))
+            criteria_list.append(tuple(str(criteria_dict[k]) for k in cols))
+
+        if not targets: return {}
+
+        # 2. 조건 컬럼만 한 번에 읽기 -> 조건에 맞는 행 수집
+        rows_by_sheet = {}
+        for (sheet_name, _, _), criteria, key_rows in zip(targets, criteria_list, backend['find'](targets)):
+            rows_to_delete = [r for r, key in key_rows if key == criteria]
+            if rows_to_delete:
+                rows_by_sheet.setdefault(sheet_name, set()).update(rows_to_delete)
+
+        # 3. 모든 시트의 삭제를 한 번에 반영
+        deleted = {sheet_name: len(rows) for sheet_name, rows in rows_by_sheet.items()}
+        if rows_by_sheet:
+            backend['delete'](rows_by_sheet)
+            for sheet_name, criteria_dict in plan:
+                if sheet_name in deleted: _cache_delete(sheet_name, criteria_dict)
+        return deleted
     except Exception as e:
         st.error(f"삭제 실패: {e}")
-        return False
+        return {}
+
+# --- 키오스크 출석 쓰기 대기열: 로컬 SQLite(WAL)에 먼저 기록하고 백그라운드에서 시트로 일괄 전송 ---
+ATTENDANCE_QUEUE_PATH = get_config("attendance_queue_path", "attendance_queue.db")
+QUEUE_FLUSH_INTERVAL = 5 # 초
+QUEUE_BATCH_SIZE = 200
+
+@st.cache_resource
+def get_attendance_queue():
+    conn = sqlite3.connect(ATTENDANCE_QUEUE_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL, created_at REAL NOT NULL)")
+    q = {'conn': conn, 'lock': threading.Lock(), 'wake': threading.Event(), 'flushed': 0, 'last_error': None}
+    # 재시작 전에 남아있던 대기 건도 이 워커가 이어서 전송함
+    threading.Thread(target=_attendance_flush_worker, args=(q,), daemon=True).start()
+    return q
+
+def enqueue_attendance(record):
+    """
+    출석 기록을 로컬 대기열에 저장 (시트 전송을 기다리지 않고 바로 반환)
+    읽기 전용 백엔드(snapshot)는 전송이 영영 안 되므로 받지 않음
+    """
+    if get_backend().get('read_only'): raise PermissionError("읽기 전용 저장소에는 출석을 기록할 수 없습니다")
+    q = get_attendance_queue()
+    with q['lock']:
+        q['conn'].execute("INSERT INTO pending (record, created_at) VALUES (?, ?)",
+                          (json.dumps(record, ensure_ascii=False), time.time()))
+    reg = get_scan_registry()
+    with reg['lock']: reg['keys'].add(attendance_key(record))
+    q['wake'].set()
+
+def get_queue_depth():
+    q = get_attendance_queue()
+    with q['lock']: return q['conn'].execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+def _sheet_attendance_keys():
+    # 시트에 실제로 있는 (날짜, 반이름, 학생) 키 (캐시가 아니라 키 컬럼을 직접 읽음)
+    headers = get_headers('attendance')
+    cols = ['날짜', '반이름', '학생']
+    if not headers or any(c not in headers for c in cols): return set()
+    return {key for _, key in get_backend()['find']([('attendance', headers, cols)])[0]}
+
+def flush_attendance_queue(q=None):
+    """
+    대기열의 출석 기록을 오래된 순서로 append_rows 한 번에 전송하고, 성공한 건만 대기열에서 지움
+    시간 초과 뒤 재시도된 append가 실제로는 성공했거나 append 후 삭제 전에 멈춘 경우를 위해,
+    시트에 이미 있는 키는 보내지 않고 함께 지움 (같은 출석이 두 번 들어가지 않게)
+    """
+    q = q or get_attendance_queue()
+    while True:
+        with q['lock']:
+            rows = q['conn'].execute("SELECT id, record FROM pending ORDER BY id LIMIT ?", (QUEUE_BATCH_SIZE,)).fetchall()
+        if not rows: return
+        sent, fresh = _sheet_attendance_keys(), []
+        for _, r in rows:
+            record = json.loads(r)
+            if attendance_key(record) in sent: continue
+            sent.add(attendance_key(record)); fresh.append(record)
+        if fresh: _append_records('attendance', fresh)
+        with q['lock']:
+            q['conn'].execute(f"DELETE FROM pending WHERE id IN ({','.join('?' * len(rows))})", [i for i, _ in rows])
+        q['flushed'] += len(fresh)
+
+def _attendance_flush_worker(q):
+    while True:
+        q['wake'].wait(QUEUE_FLUSH_INTERVAL)
+        q['wake'].clear()
+        try:
+            flush_attendance_queue(q)
+            q['last_error'] = None
+        except Exception as e:
+            q['last_error'] = str(e)
+
+# --- 키오스크 중복 스캔 방지: 최근 스캔 응답 재사용 + (날짜, 반이름, 학생) 출석 키 ---
+SCAN_DEDUPE_TTL = float(get_config("scan_dedupe_ttl", 60)) # 같은 QR을 이 시간(초) 안에 다시 찍으면 이전 응답을 그대로 보여줌
+
+def attendance_key(record):
+    return (str(record.get('날짜', '')), str(record.get('반이름', '')), str(record.get('학생', '')))
+
+@st.cache_resource
+def get_scan_registry():
+    # recent: {QR 내용: (시각, 응답)}, keys: 이 프로세스에서 대기열에 넣은 출석 키 (재시작 시 대기 중인 건 포함)
+    reg = {'recent': {}, 'keys': set(), 'lock': threading.Lock()}
+    q = get_attendance_queue()
+    with q['lock']:
+        for (r,) in q['conn'].execute("SELECT record FROM pending"): reg['keys'].add(attendance_key(json.loads(r)))
+    return reg
+
+def get_recent_scan(payload):
+    reg = get_scan_registry()
+    with reg['lock']:
+        now = time.time()
+        for k in [k for k, (t, _) in reg['recent'].items() if now - t > SCAN_DEDUPE_TTL]: del reg['recent'][k]
+        hit = reg['recent'].get(payload)
+    return hit[1] if hit else None
+
+def remember_scan(payload, response):
+    reg = get_scan_registry()
+    with reg['lock']: reg['recent'][payload] = (time.time(), response)
+
+def build_attendance_keys(df_a, date_str):
+    if df_a.empty or len(df_a.columns) < 3: return set()
+    dates = get_col_data(df_a, '날짜', 0).astype(str)
+    day_rows = df_a[dates == date_str]
+    return set(zip(get_col_data(day_rows, '날짜', 0).astype(str), get_col_data(day_rows, '반이름', 1).astype(str),
+                   get_col_data(day_rows, '학생', 2).astype(str)))
+
+def is_attendance_recorded(record, df_a):
+    """
+    같은 (날짜, 반이름, 학생) 출석이 이미 있는지: 대기열에 넣은 키 -> 오늘 출석 인덱스 순서로 확인 (API 호출 없음)
+    """
+    key = attendance_key(record)
+    reg = get_scan_registry()
+    if key in reg['keys']: return True
+    return key in get_derived(f"attendance_keys:{key[0]}", ['attendance'], lambda: build_attendance_keys(df_a, key[0]))
 
 # --- 유틸리티 ---
 def calc_duration_min(s, e):
@@ -267,37 +1569,680 @@ def get_col_data(df, col, idx):
     elif len(df.columns) > idx: return df.iloc[:, idx]
     else: return pd.Series([])
 
+# --- 타입 있는 프레임: 시트가 바뀔 때만 스키마 컬럼 이름/타입으로 한 번 변환 (화면은 컬럼 이름으로 읽음) ---
+# 선택 상자용 라벨 컬럼 (변환할 때 함께 만듦, '_'로 시작하는 컬럼은 표에 보여주지 않음)
+SHEET_LABELS = {
+    'teachers': {'_label': ('이름', '과목')},                                  # 김철수 (수학)
+    'students': {'_label': ('이름', '학교'), '_label_grade': ('이름', '학년')},  # 홍길동 (형설중) / 홍길동 (중1)
+    'classes': {'_label': ('반이름', '시간')},                                 # 수학A (월 10:00-12:00)
+}
+
+def build_typed_frame(sheet_name, df):
+    """
+    문자열 DataFrame -> 스키마 타입 프레임 (헤더 이름이 다르면 위치로 찾고, 없는 컬럼은 빈 값, 나머지 컬럼은 그대로)
+    """
+    schema = SHEET_SCHEMAS.get(sheet_name, {})
+    cols = {}
+    for i, (col, kind) in enumerate(schema.items()):
+        s = get_col_data(df, col, i)
+        s = s.reset_index(drop=True).astype(str) if len(s) == len(df) else pd.Series([""] * len(df), dtype=str)
+        if kind == 'category': s = s.astype('category')
+        elif kind == 'date': s = pd.to_datetime(s.str.strip().str[:10], format='%Y-%m-%d', errors='coerce')
+        cols[col] = s
+    for col in df.columns:
+        if col not in cols and col not in schema: cols[col] = df[col].reset_index(drop=True)
+    typed = pd.DataFrame(cols)
+    for label, (a, b) in SHEET_LABELS.get(sheet_name, {}).items():
+        typed[label] = typed[a].astype(str) + " (" + typed[b].astype(str) + ")"
+    return typed
+
+def load_typed(sheet_names, force=False):
+    """
+    여러 시트를 타입 있는 프레임으로 불러오기 (시트 버전이 바뀔 때만 다시 변환)
+    여러 화면/세션이 같은 프레임을 공유하므로 읽기 전용 (컬럼 추가/수정 금지)
+    """
+    snap = load_snapshot(sheet_names, force=force, copy=False)
+    return {n: get_derived(f"typed:{n}", [n], lambda n=n: build_typed_frame(n, snap[n])) for n in sheet_names}
+
+def visible_cols(df):
+    # 라벨 등 내부용('_'로 시작) 컬럼을 뺀 표시용 프레임
+    return df[[c for c in df.columns if not str(c).startswith('_')]]
+
+# --- 시간표 인덱스 ---
+DAYS_KO = ["월", "화", "수", "목", "금", "토", "일"]
+SCHEDULE_COLS = ['class_name', 'teacher', 'subject', 'teacher_raw', 'room', 'day', 'day_idx',
+                 'start', 'end', 'start_min', 'end_min', 'dur']
+
+def time_to_min(t):
+    h, m = t.strip().split(':')
+    return int(h) * 60 + int(m)
+
+def parse_schedule(schedule_str):
+    """
+    "월 15:00-16:30, 수 17:00-18:00" -> [('월', '15:00', '16:30', 900, 990), ...] (형식이 틀린 항목은 건너뜀)
+    """
+    parsed = []
+    for tp in str(schedule_str).split(','):
+        kp = tp.strip().split()
+        if len(kp) != 2 or kp[0] not in DAYS_KO: continue
+        try:
+            s, e = kp[1].split('-')
+            parsed.append((kp[0], s, e, time_to_min(s), time_to_min(e)))
+        except: pass
+    return parsed
+
+def split_teacher_label(full_tea):
+    # "김철수 (수학)" -> ("김철수", "수학")
+    full_tea = str(full_tea)
+    if "(" not in full_tea: return full_tea.strip(), "과목"
+    return full_tea.split('(')[0].strip(), full_tea.split('(')[1].replace(')', '').strip()
+
+def build_schedule_index(df_c):
+    """
+    반 시트의 '시간' 문자열을 한 번만 파싱해서 (반, 강사, 강의실, 요일, 시작/종료 분) 표로 만듦
+    """
+    rows = []
+    if not df_c.empty and len(df_c.columns) > 2:
+        names, teas = get_col_data(df_c, '반이름', 0), get_col_data(df_c, '선생님', 1)
+        times = get_col_data(df_c, '시간', 2)
+        rooms = get_col_data(df_c, '강의실', 3) if len(df_c.columns) > 3 else pd.Series([""] * len(df_c))
+        for c_name, tea, t_str, room in zip(names, teas, times, rooms):
+            tn, sub = split_teacher_label(tea)
+            for day, s, e, s_min, e_min in parse_schedule(t_str):
+                rows.append((c_name, tn, sub, str(tea), str(room), day, DAYS_KO.index(day),
+                             s, e, s_min, e_min, max(e_min - s_min, 0)))
+    idx = pd.DataFrame(rows, columns=SCHEDULE_COLS).astype({'day_idx': 'int8', 'start_min': 'int16', 'end_min': 'int16', 'dur': 'int16'})
+    return idx.sort_values(['start_min', 'day_idx', 'class_name'], kind='stable').reset_index(drop=True)
+
+def get_schedule_index(df_c):
+    return get_derived('schedule_index', ['classes'], lambda: build_schedule_index(df_c))
+
+def build_roster_index(df_e, df_s):
+    """
+    반이름 -> [(학생 이름, 학년, 학교), ...] 수강생 명단 (수강 배정 + 학생 정보를 한 번에 merge)
+    """
+    if df_e.empty or df_s.empty or len(df_e.columns) < 3 or len(df_s.columns) < 5: return {}
+    enr = pd.DataFrame({'class_name': get_col_data(df_e, '반이름', 2).values,
+                        'student': get_col_data(df_e, '학생', 0).values}).drop_duplicates()
+    std = pd.DataFrame({'student': get_col_data(df_s, '이름', 0).values,
+                        'grade': get_col_data(df_s, '학년', 3).values,
+                        'school': get_col_data(df_s, '학교', 4).values})
+    merged = enr.merge(std, on='student').sort_values(['class_name', 'student'], kind='stable')
+    return {c: list(zip(g['student'], g['grade'], g['school']))
+            for c, g in merged.groupby('class_name', sort=False, observed=True)}
+
+def get_roster_index(df_e, df_s):
+    return get_derived('roster_index', ['enrollments', 'students'], lambda: build_roster_index(df_e, df_s))
+
+# --- 수강 배정 인덱스 (장바구니 중복 검사/라벨 조회를 해시로) ---
+ENROLL_KEY_COLS = ('학생', '과목', '반이름')
+
+def enrollment_key(item):
+    # 수강 배정 한 건(dict) -> (학생, 과목, 반이름)
+    return tuple(str(item[c]) for c in ENROLL_KEY_COLS)
+
+def get_enrollment_keys(df_e):
+    """
+    이미 저장된 (학생, 과목, 반이름) 집합 (수강 배정 시트 버전이 바뀔 때만 다시 만듦)
+    """
+    def build():
+        if df_e.empty or len(df_e.columns) < 3: return frozenset()
+        return frozenset(zip(*(get_col_data(df_e, c, i).astype(str) for i, c in enumerate(ENROLL_KEY_COLS))))
+    return get_derived('enrollment_keys', ['enrollments'], build)
+
+def get_label_index(sheet_name, df, label_col='_label'):
+    # 라벨 -> 행 위치 (load_typed 프레임 기준, selectbox에서 고른 라벨로 행을 바로 찾음)
+    return get_derived(f"label_index:{sheet_name}:{label_col}", [sheet_name],
+                       lambda: {label: i for i, label in enumerate(df[label_col])} if label_col in df.columns else {})
+
+# --- 학생 일괄 가져오기 (CSV/XLSX -> 검증 -> 청크 단위 추가, 중단되면 같은 파일로 이어서) ---
+IMPORT_COLS = SHEET_HEADERS['students'] + ['반이름'] # 반이름은 여러 개면 쉼표로 구분
+IMPORT_CHUNK = 200 # 청크 하나 = 학생 append_rows 1번 + 수강 배정 append_rows 1번
+IMPORT_PHONE_COLS = ('연락처', '학부모연락처')
+
+def _import_cell(col, v):
+    # 엑셀 숫자 셀("1012345678.0")과 빈 셀 정리, 앞자리 0이 빠진 휴대폰 번호 복원
+    if v is None or (isinstance(v, float) and v != v): return ""
+    if isinstance(v, float) and v.is_integer(): v = int(v)
+    v = str(v).strip()
+    if col in IMPORT_PHONE_COLS and v.isdigit() and len(v) == 10 and v.startswith("1"): v = "0" + v
+    return v
+
+def iter_import_rows(data, file_name, chunk_size=IMPORT_CHUNK):
+    """
+    업로드 파일 bytes -> [(원본 행 번호, {컬럼: 값}), ...]을 chunk_size개씩 (파일 전체를 DataFrame으로 올리지 않음)
+    빈 줄은 건너뛰되 행 번호는 원본 파일 기준 그대로 (1행 = 헤더)
+    """
+    if file_name.lower().endswith(".xlsx"):
+        import openpyxl # 가져오기 화면에서만 쓰므로 여기서 불러옴
+        wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [_import_cell("", h) for h in next(rows, ())]
+        chunk = []
+        for line, r in enumerate(rows, start=2):
+            if not any(c not in (None, "") for c in r): continue
+            chunk.append((line, {h: _import_cell(h, c) for h, c in zip(header, r) if h}))
+            if len(chunk) >= chunk_size: yield chunk; chunk = []
+        if chunk: yield chunk
+        wb.close()
+    else:
+        text = io.StringIO(data.decode("utf-8-sig", errors="replace"))
+        # 빈 줄도 행으로 받아야 인덱스(= 원본 줄 번호 - 2)가 어긋나지 않음
+        for df in pd.read_csv(text, dtype=str, keep_default_na=False, skip_blank_lines=False, chunksize=chunk_size):
+            df.columns = [str(c).strip() for c in df.columns]
+            rows = [(i + 2, {h: _import_cell(h, v) for h, v in row.items()}) for i, row in zip(df.index, df.to_dict('records'))]
+            # 엑셀에서 내보낸 CSV 끝의 ",,,,," 같은 빈 줄은 XLSX처럼 건너뜀
+            rows = [(line, r) for line, r in rows if any(r.values())]
+            if rows: yield rows
+
+def plan_import(data, file_name, df_s, df_c, df_e):
+    """
+    파일을 훑으며 기존 학생/반/수강 인덱스와 대조 -> (검증 결과 DataFrame, 청크별 [(학생 행 또는 None, 수강 행들)])
+    기존 학생은 학생 행을 건너뛰고 새 수강만 추가 (중단 후 다시 실행하면 이미 들어간 행은 저절로 걸러짐)
+    """
+    known = set(get_col_data(df_s, '이름', 0).astype(str)) if not df_s.empty else set()
+    class_teacher = dict(zip(get_col_data(df_c, '반이름', 0).astype(str), get_col_data(df_c, '선생님', 1).astype(str))) if not df_c.empty else {}
+    enrolled = set(get_enrollment_keys(df_e))
+    today = str(datetime.today().date())
+    report, chunks, seen = [], [], set()
+    for rows in iter_import_rows(data, file_name):
+        chunk = []
+        for line, r in rows:
+            name = r.get('이름', "")
+            classes = [c.strip() for c in str(r.get('반이름', "")).replace(";", ",").split(",") if c.strip()]
+            unknown = [c for c in classes if c not in class_teacher]
+            if not name: status, note = "오류", "이름 없음"
+            elif name in seen: status, note = "중복", "파일 안에서 중복"
+            elif unknown: status, note = "오류", "없는 반: " + ", ".join(unknown)
+            else:
+                status, note = ("기존 학생", "학생 정보는 그대로, 새 수강만 추가") if name in known else ("신규", "")
+                enrolls = []
+                for c in classes:
+                    tea = class_teacher[c]
+                    item = {'학생': name, '과목': split_teacher_label(tea)[1], '반이름': c, '담당강사': tea, '날짜': today}
+                    if enrollment_key(item) in enrolled: continue
+                    enrolled.add(enrollment_key(item)); enrolls.append(item)
+                student = None if name in known else {h: r.get(h, "") for h in SHEET_HEADERS['students']}
+                if student is None and not enrolls: status, note = "중복", "이미 등록/수강 중"
+                else:
+                    chunk.append((student, enrolls))
+                    seen.add(name) # 오류로 빠진 행은 넣지 않음 -> 뒤에 고쳐 쓴 같은 이름 행은 정상 처리
+            report.append((line, name, r.get('학교', ""), ", ".join(classes), status, note))
+        if chunk: chunks.append(chunk)
+    df_report = pd.DataFrame(report, columns=['행', '이름', '학교', '반이름', '상태', '내용'])
+    return df_report, chunks
+
+@st.cache_resource
+def get_import_lock():
+    # 가져오기는 한 번에 하나만 (두 세션이 같은 파일을 동시에 넣지 않도록 검증~추가를 한 덩어리로)
+    return threading.Lock()
+
+def run_import(data, file_name, on_progress=None):
+    """
+    최신 캐시로 다시 검증한 뒤 청크마다 학생/수강 배정 append 각 1번 -> (검증 결과, 추가한 학생 수, 추가한 수강 수)
+    중간에 실패해도 이미 들어간 행은 다음 실행의 검증에서 걸러지므로 같은 파일로 다시 실행하면 이어서 진행됨
+    """
+    added_s = added_e = 0
+    with get_import_lock():
+        snap = load_snapshot(['students', 'classes', 'enrollments'], copy=False)
+        report, chunks = plan_import(data, file_name, snap['students'], snap['classes'], snap['enrollments'])
+        for i, chunk in enumerate(chunks):
+            students = [s for s, _ in chunk if s]
+            enrolls = [e for _, es in chunk for e in es]
+            if students: _append_records('students', students)
+            if enrolls: _append_records('enrollments', enrolls)
+            added_s += len(students); added_e += len(enrolls)
+            if on_progress: on_progress(i + 1, len(chunks))
+    return report, added_s, added_e
+
+# --- 시간 충돌 검사 (강의실/강사/학생별로 요일마다 구간 트리) ---
+CONFLICT_FREE_ROOMS = {"", "기타"} # 여러 반이 같이 쓰는 공간은 강의실 충돌로 보지 않음
+CONFLICT_KINDS = (('room', '강의실'), ('teacher', '강사'), ('student', '학생'))
+
+def min_to_time(m):
+    return f"{int(m) // 60:02d}:{int(m) % 60:02d}"
+
+def build_interval_tree(intervals):
+    """
+    [(시작 분, 끝 분, 반이름), ...] -> 시작 순 정렬 배열 + 부분 트리별 최대 끝값 (배열 위의 균형 이진 트리)
+    """
+    items = sorted(intervals)
+    max_end = [0] * len(items)
+    def fill(lo, hi):
+        if lo >= hi: return -1
+        mid = (lo + hi) // 2
+        max_end[mid] = max(items[mid][1], fill(lo, mid), fill(mid + 1, hi))
+        return max_end[mid]
+    fill(0, len(items))
+    return {'items': items, 'max_end': max_end}
+
+def query_interval_tree(tree, start, end):
+    """
+    [start, end)와 겹치는 구간 목록 (O(log n + 결과 수), 끝과 시작이 맞닿는 건 겹침 아님)
+    """
+    items, max_end, found = tree['items'], tree['max_end'], []
+    def visit(lo, hi):
+        if lo >= hi: return
+        mid = (lo + hi) // 2
+        if max_end[mid] <= start: return # 이 부분 트리는 전부 start 전에 끝남
+        visit(lo, mid)
+        s, e, _ = items[mid]
+        if s >= end: return # 오른쪽은 전부 end 이후에 시작
+        if e > start: found.append(items[mid])
+        visit(mid + 1, hi)
+    visit(0, len(items))
+    return found
+
+def build_conflict_index(sched, df_e):
+    """
+    시간표 인덱스 + 수강 배정 -> {'room'|'teacher'|'student': {(이름, 요일 번호): 구간 트리}, 'slots': {반이름: [(요일 번호, 시작, 끝)]}}
+    """
+    slots, buckets = {}, {kind: {} for kind, _ in CONFLICT_KINDS}
+    for r in sched.itertuples(index=False):
+        iv = (int(r.start_min), int(r.end_min), r.class_name)
+        slots.setdefault(r.class_name, []).append((int(r.day_idx),) + iv[:2])
+        buckets['teacher'].setdefault((r.teacher, int(r.day_idx)), []).append(iv)
+        if r.room not in CONFLICT_FREE_ROOMS: buckets['room'].setdefault((r.room, int(r.day_idx)), []).append(iv)
+    if not df_e.empty and len(df_e.columns) > 2:
+        for student, c_name in set(zip(get_col_data(df_e, '학생', 0).astype(str), get_col_data(df_e, '반이름', 2).astype(str))):
+            for d, s, e in slots.get(c_name, []):
+                buckets['student'].setdefault((student, d), []).append((s, e, c_name))
+    index = {kind: {k: build_interval_tree(v) for k, v in b.items()} for kind, b in buckets.items()}
+    index['slots'] = slots
+    return index
+
+def get_conflict_index(df_c, df_e):
+    return get_derived('conflict_index', ['classes', 'enrollments'],
+                       lambda: build_conflict_index(get_schedule_index(df_c), df_e))
+
+def schedule_slots(schedule_str):
+    # "월 15:00-16:30, ..." -> [(요일 번호, 시작 분, 끝 분), ...]
+    return [(DAYS_KO.index(day), s_min, e_min) for day, _, _, s_min, e_min in parse_schedule(schedule_str)]
+
+def _conflict_msg(label, key, d, s, e, other, os_, oe):
+    return f"{label} {key}: {DAYS_KO[d]} {min_to_time(s)}-{min_to_time(e)} ↔ '{other}' ({min_to_time(os_)}-{min_to_time(oe)})"
+
+def check_class_conflicts(idx, schedule_str, teacher_label, room, ignore_class=None):
+    """
+    새로 만들거나 고칠 반의 시간이 같은 강사/강의실의 다른 반과 겹치는지 -> [충돌 설명, ...]
+    """
+    teacher = split_teacher_label(teacher_label)[0]
+    checks = [('teacher', teacher, '강사')] + ([] if room in CONFLICT_FREE_ROOMS else [('room', room, '강의실')])
+    msgs = []
+    for d, s, e in schedule_slots(schedule_str):
+        for kind, key, label in checks:
+            tree = idx[kind].get((key, d))
+            for os_, oe, other in (query_interval_tree(tree, s, e) if tree else []):
+                if other != ignore_class: msgs.append(_conflict_msg(label, key, d, s, e, other, os_, oe))
+    return msgs
+
+def check_student_conflicts(idx, student, class_name, extra_classes=(), slots=None):
+    """
+    학생이 class_name을 들을 때 이미 듣는 반(+ 아직 저장 안 한 extra_classes)과 겹치는지 -> [충돌 설명, ...]
+    slots를 주면 (반 시간 수정 중) 저장된 시간 대신 그 시간으로 검사
+    """
+    slots = idx['slots'].get(class_name, []) if slots is None else slots
+    extra = [(d, s, e, c) for c in set(extra_classes) if c != class_name for d, s, e in idx['slots'].get(c, [])]
+    msgs = []
+    for d, s, e in slots:
+        tree = idx['student'].get((student, d))
+        hits = [h for h in (query_interval_tree(tree, s, e) if tree else []) if h[2] != class_name]
+        hits += [(os_, oe, c) for od, os_, oe, c in extra if od == d and os_ < e and s < oe]
+        msgs += [_conflict_msg('학생', student, d, s, e, c, os_, oe) for os_, oe, c in hits]
+    return msgs
+
+def audit_conflicts(idx):
+    """
+    학원 전체 충돌 목록 (강의실/강사/학생마다 요일별로 시작 순으로 한 번씩 훑음) -> DataFrame
+    """
+    rows = []
+    for kind, label in CONFLICT_KINDS:
+        for (key, d), tree in idx[kind].items():
+            active = [] # 아직 안 끝난 구간
+            for s, e, c in tree['items']:
+                active = [a for a in active if a[1] > s]
+                rows += [(label, key, DAYS_KO[d], a_c, f"{min_to_time(a_s)}-{min_to_time(a_e)}", c, f"{min_to_time(s)}-{min_to_time(e)}")
+                         for a_s, a_e, a_c in active if a_c != c]
+                active.append((s, e, c))
+    df = pd.DataFrame(rows, columns=['종류', '대상', '요일', '반 1', '시간 1', '반 2', '시간 2'])
+    return df.sort_values(['종류', '대상'], kind='stable').reset_index(drop=True)
+
+# --- 빈 시간 찾기 (충돌 인덱스 위에서 강사/학생/강의실이 모두 빈 시간 계산) ---
+SLOT_DAY_RANGE = (9 * 60, 22 * 60 + 50) # 반 개설 화면에서 고를 수 있는 시간 범위
+SLOT_STEP = 10
+SLOT_ROOM_WEIGHT = 30 # 선호 순위 한 칸 = 공강 30분
+
+def _busy_ranges(idx, keys, d):
+    # 여러 (종류, 이름)의 해당 요일 수업 구간을 합쳐 병합 -> [[시작, 끝], ...]
+    merged = []
+    for s, e in sorted(iv[:2] for kind, key in keys for iv in idx[kind].get((key, d), {'items': []})['items']):
+        if merged and s <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], e)
+        else: merged.append([s, e])
+    return merged
+
+def _free_starts(busy, duration, step):
+    # 병합된 busy 사이 빈 시간에 duration이 들어가는 시작 시각들 (step분 단위)
+    lo, hi = SLOT_DAY_RANGE
+    starts, cur = set(), lo
+    for s, e in busy + [[hi, hi]]:
+        starts.update(range(-(-cur // step) * step, min(s, hi) - duration + 1, step))
+        cur = max(cur, e)
+    return starts
+
+def find_free_slots(idx, teacher_label, duration, days, rooms, students=(), limit=30, step=SLOT_STEP):
+    """
+    강사와 학생이 모두 비어 있고 강의실도 빈 (요일, 시작, 강의실) 후보를 점수 순으로 -> DataFrame
+    점수 = 강사의 같은 날 다른 수업과의 공강(분, 그날 수업이 없으면 240) + 강의실 선호 순위 x 30 (낮을수록 좋음)
+    """
+    teacher = split_teacher_label(teacher_label)[0]
+    people = [('teacher', teacher)] + [('student', s) for s in students]
+    rows = []
+    for day in days:
+        d = DAYS_KO.index(day)
+        starts = _free_starts(_busy_ranges(idx, people, d), duration, step)
+        t_busy = _busy_ranges(idx, [('teacher', teacher)], d)
+        for rank, room in enumerate(rooms):
+            room_starts = starts if room in CONFLICT_FREE_ROOMS else starts & _free_starts(_busy_ranges(idx, [('room', room)], d), duration, step)
+            for s in room_starts:
+                e = s + duration
+                idle = min((max(bs - e, s - be) for bs, be in t_busy), default=240)
+                rows.append((day, min_to_time(s), min_to_time(e), room, idle, idle + rank * SLOT_ROOM_WEIGHT,
+                             f"{day} {min_to_time(s)}-{min_to_time(e)}", d, s))
+    df = pd.DataFrame(rows, columns=['요일', '시작', '끝', '강의실', '공강(분)', '점수', '시간', '_day', '_start'])
+    return df.sort_values(['점수', '_day', '_start'], kind='stable').head(limit).reset_index(drop=True)
+
+# --- 키오스크 인덱스 ---
+def build_kiosk_index(df_s, df_e, df_c):
+    """
+    QR 내용("이름/폰뒤4자리") -> {'name', 'week': {요일: [(시작 분, 종료 분, 반이름), ...]}}
+    """
+    class_sessions = {}
+    for r in get_schedule_index(df_c).itertuples():
+        class_sessions.setdefault(r.class_name, []).append((r.day, r.start_min, r.end_min))
+    enrolled = {}
+    if not df_e.empty and len(df_e.columns) > 2:
+        for s, c in zip(get_col_data(df_e, '학생', 0), get_col_data(df_e, '반이름', 2)):
+            enrolled.setdefault(s, {})[c] = True # 순서 유지 + 중복 제거
+
+    by_payload, by_name = {}, {}
+    if not df_s.empty and len(df_s.columns) > 1:
+        for name, phone in zip(get_col_data(df_s, '이름', 0), get_col_data(df_s, '연락처', 1)):
+            week = {d: [] for d in DAYS_KO}
+            for c in enrolled.get(name, {}):
+                for day, s_min, e_min in class_sessions.get(c, []): week[day].append((s_min, e_min, c))
+            for d in week: week[d].sort()
+            entry = {'name': name, 'week': week}
+            by_payload[f"{name}/{str(phone)[-4:]}"] = entry
+            by_name.setdefault(name, entry)
+    return {'by_payload': by_payload, 'by_name': by_name}
+
+def get_kiosk_index(df_s, df_e, df_c):
+    return get_derived('kiosk_index', ['students', 'enrollments', 'classes'], lambda: build_kiosk_index(df_s, df_e, df_c))
+
+def kiosk_lookup(kiosk_index, payload, now):
+    """
+    QR 내용으로 학생과 지금 체크할 오늘 수업(진행 중이거나 다음 수업, 없으면 마지막 수업)을 찾음
+    예전 QR(이름만 있거나 연락처가 바뀐 경우)은 이름으로 찾음
+    """
+    entry = kiosk_index['by_payload'].get(payload) or kiosk_index['by_name'].get(payload.split('/')[0])
+    if entry is None: return None, None
+    today = entry['week'][DAYS_KO[now.weekday()]]
+    now_min = now.hour * 60 + now.minute
+    session = next((s for s in today if now_min < s[1]), today[-1] if today else None)
+    return entry, session
+
+# --- 출석 집계: (학생, 반, 월, 상태)별 횟수 (출석 행이 추가되면 그 행만 더함) ---
+ATTENDANCE_PRESENT = ('출석', '지각', '보강', '보강/자습') # 출석률 계산 시 출석으로 보는 상태 (보강/자습 = 키오스크 조기 입실)
+AGG_KEYS = ['학생', '반이름', '월', '상태']
+
+@st.cache_resource
+def get_attendance_aggregates():
+    # counts: {(학생, 반이름, 'YYYY-MM', 상태): 횟수}, version: 집계 기준 attendance 시트 버전 (None = 다시 만들어야 함)
+    # frame: counts를 표로 바꾼 것 (counts가 바뀔 때만 다시 만듦)
+    return {'counts': {}, 'version': None, 'frame': None, 'lock': threading.RLock()}
+
+def build_attendance_counts(df_a):
+    if df_a.empty or len(df_a.columns) < 4: return {}
+    keys = pd.DataFrame({'학생': get_col_data(df_a, '학생', 2).values,
+                         '반이름': get_col_data(df_a, '반이름', 1).values,
+                         '월': get_col_data(df_a, '날짜', 0).astype(str).str[:7].values,
+                         '상태': get_col_data(df_a, '상태', 3).values})
+    return keys.groupby(AGG_KEYS, sort=False, observed=True).size().to_dict()
+
+def _aggregate_append(sheet_name, headers, rows, since_version):
+    # 집계가 추가 직전 시트 버전 기준이면 추가된 행만 더함 (아니면 다음 조회 때 전체를 다시 집계)
+    if sheet_name != 'attendance': return
+    agg = get_attendance_aggregates()
+    with agg['lock']:
+        if agg['version'] is None or agg['version'] != since_version: return
+        for key, n in build_attendance_counts(pd.DataFrame(rows, columns=headers)).items():
+            agg['counts'][key] = agg['counts'].get(key, 0) + n
+        agg['version'] = get_table_version(sheet_name)
+        agg['frame'] = None
+
+def invalidate_aggregates(sheet_name):
+    # 수정/삭제는 어떤 칸이 바뀌었는지 모르므로 다음 조회 때 다시 집계
+    if sheet_name != 'attendance': return
+    agg = get_attendance_aggregates()
+    with agg['lock']: agg['version'] = None
+
+def get_attendance_summary(df_a):
+    """
+    출석 집계표 DataFrame[학생, 반이름, 월, 상태, 횟수]
+    시트 버전이 집계 기준과 다를 때만(외부 수정, 수정/삭제 후) df_a 전체를 다시 집계함
+    """
+    agg = get_attendance_aggregates()
+    with agg['lock']:
+        version = get_table_version('attendance')
+        if agg['version'] != version:
+            agg['counts'], agg['version'], agg['frame'] = build_attendance_counts(df_a), version, None
+        if agg['frame'] is None:
+            agg['frame'] = pd.DataFrame([k + (n,) for k, n in agg['counts'].items()], columns=AGG_KEYS + ['횟수'])
+        return agg['frame']
+
+def attach_attendance_dims(summary, df_c, df_s):
+    # 집계표에 반 -> 담당 강사, 학생 -> 학년을 붙임
+    teachers = dict(zip(get_col_data(df_c, '반이름', 0), (split_teacher_label(t)[0] for t in get_col_data(df_c, '선생님', 1))))
+    grades = dict(zip(get_col_data(df_s, '이름', 0), get_col_data(df_s, '학년', 3)))
+    out = summary.copy()
+    out['강사'] = out['반이름'].map(teachers).fillna("(미지정)")
+    out['학년'] = out['학생'].map(grades).fillna("(미등록)")
+    return out
+
+def build_attendance_rates(summary, group_col):
+    """
+    집계표를 group_col(반이름/강사/학년) 기준으로 묶어 상태별 횟수, 전체, 출석률(%) 계산
+    """
+    table = summary.pivot_table(index=group_col, columns='상태', values='횟수', aggfunc='sum', fill_value=0)
+    table.columns.name = None
+    table['전체'] = table.sum(axis=1)
+    present = table[[s for s in ATTENDANCE_PRESENT if s in table.columns]].sum(axis=1)
+    table['출석률(%)'] = (present / table['전체'] * 100).round(1)
+    return table.sort_values('출석률(%)', ascending=False)
+
 # QR 관련
-def generate_styled_qr(data, student_name):
-    qr = qrcode.QRCode(version=1, box_size=10, border=2)
-    qr.add_data(data); qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-    top_p, bot_p = 60, 60
-    canvas_w, canvas_h = qr_img.width + 40, qr_img.height + top_p + bot_p
-    canvas = Image.new("RGB", (canvas_w, canvas_h), "white")
-    canvas.paste(qr_img, ((canvas_w - qr_img.width) // 2, top_p))
-    draw = ImageDraw.Draw(canvas)
-    
-    font_path = "font.ttf" if os.path.exists("font.ttf") else "/System/Library/Fonts/Supplemental/AppleGothic.ttf"
-    try:
-        fh = ImageFont.truetype(font_path, 30); fn = ImageFont.truetype(font_path, 35)
-    except:
-        fh = ImageFont.load_default(); fn = ImageFont.load_default()
-        
-    draw.text(((canvas_w - draw.textlength("형설지공 학원", font=fh)) / 2, 15), "형설지공 학원", fill="black", font=fh)
-    draw.text(((canvas_w - draw.textlength(student_name, font=fn)) / 2, canvas_h - 50), student_name, fill="black", font=fn)
-    return canvas
+# --- QR 카드 캐시: (QR 내용, 이름, 스타일) 해시 -> PNG ---
+QR_CARD_CACHE_SIZE = 2000
+QR_POOL_MIN_JOBS = 24 # 이보다 적으면 프로세스 풀 없이 바로 생성
+
+@st.cache_resource
+def get_qr_card_cache():
+    return {'cards': OrderedDict(), 'lock': threading.Lock()}
+
+def qr_payload(name, phone):
+    # 키오스크에서 읽는 QR 내용 형식: "이름/폰뒤4자리"
+    return f"{name}/{str(phone)[-4:] if str(phone) else '0000'}"
+
+def _qr_card_key(payload, student_name, style):
+    return hashlib.sha1(json.dumps([payload, student_name, style], ensure_ascii=False).encode()).hexdigest()
+
+def _qr_cache_put(key, png):
+    cache = get_qr_card_cache()
+    with cache['lock']:
+        cache['cards'][key] = png
+        cache['cards'].move_to_end(key)
+        while len(cache['cards']) > QR_CARD_CACHE_SIZE: cache['cards'].popitem(last=False)
+
+def get_qr_card_png(payload, student_name, style=qr_cards.DEFAULT_STYLE):
+    cache = get_qr_card_cache()
+    key = _qr_card_key(payload, student_name, style)
+    with cache['lock']:
+        if key in cache['cards']:
+            cache['cards'].move_to_end(key)
+            return cache['cards'][key]
+    png = qr_cards.render_card_png((payload, student_name, style))
+    _qr_cache_put(key, png)
+    return png
+
+def render_qr_cards_bulk(jobs):
+    """
+    [(QR 내용, 이름, 스타일), ...] -> PNG 목록 (캐시에 없는 카드만 프로세스 풀로 생성)
+    """
+    cache = get_qr_card_cache()
+    keys = [_qr_card_key(*job) for job in jobs]
+    with cache['lock']: results = [cache['cards'].get(k) for k in keys]
+    todo = [i for i, png in enumerate(results) if png is None]
+
+    rendered = None
+    if len(todo) >= QR_POOL_MIN_JOBS:
+        try:
+            # streamlit 서버 프로세스를 fork하지 않도록 spawn 사용
+            with ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn")) as pool:
+                rendered = list(pool.map(qr_cards.render_card_png, [jobs[i] for i in todo], chunksize=8))
+        except Exception:
+            rendered = None
+    if rendered is None: rendered = [qr_cards.render_card_png(jobs[i]) for i in todo]
+
+    for i, png in zip(todo, rendered):
+        results[i] = png
+        _qr_cache_put(keys[i], png)
+    return results
+
+def export_qr_cards(students, fmt="pdf"):
+    """
+    students: [(이름, 연락처), ...] -> A4 격자 PDF 또는 학생별 PNG ZIP (bytes)
+    """
+    jobs = [(qr_payload(n, p), n, qr_cards.DEFAULT_STYLE) for n, p in students]
+    pngs = render_qr_cards_bulk(jobs)
+    if fmt == "pdf": return qr_cards.tile_a4_pdf(pngs)
+    return qr_cards.zip_pngs([(f"형설지공_{n}_QR.png", png) for (n, _), png in zip(students, pngs)])
+
+# --- QR 인식 파이프라인: 흑백 디코딩 -> 이전 위치(ROI) -> 축소 피라미드 -> 원본 순서로 시도 ---
+QR_PYRAMID_WIDTHS = (480, 800) # 이 가로 폭들로 줄여서 먼저 시도, 모두 실패하면 원본 해상도
+QR_ROI_MARGIN = 0.5 # 이전 QR 영역 크기 대비 여유 비율
+QR_STAGES = ('imdecode', 'roi', 'pyramid', 'full', 'total')
+
+@st.cache_resource
+def get_qr_decoder():
+    # detector는 한 번만 생성, roi는 직전 프레임에서 찾은 QR 위치 (프레임 크기 대비 비율)
+    return {
+        'detector': cv2.QRCodeDetector(), 'roi': None, 'lock': threading.Lock(),
+        'timings': {s: deque(maxlen=500) for s in QR_STAGES},
+        'hits': {s: 0 for s in ('roi', 'pyramid', 'full', 'miss')},
+    }
+
+def _qr_points_to_roi(points, scale, w, h):
+    # 찾은 QR 꼭짓점(축소 좌표) -> 원본 기준 (x0, y0, x1, y1) 비율 + 여유 영역
+    pts = points.reshape(-1, 2) / scale
+    x0, y0 = pts.min(axis=0); x1, y1 = pts.max(axis=0)
+    mx, my = (x1 - x0) * QR_ROI_MARGIN, (y1 - y0) * QR_ROI_MARGIN
+    return (max(0, x0 - mx) / w, max(0, y0 - my) / h, min(w, x1 + mx) / w, min(h, y1 + my) / h)
+
+def decode_qr_bytes(bytes_data):
+    dec = get_qr_decoder()
+    t_start = time.perf_counter()
+    timings = {}
+
+    t = time.perf_counter()
+    img = cv2.imdecode(np.frombuffer(bytes_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    timings['imdecode'] = time.perf_counter() - t
+    if img is None: return None
+    h, w = img.shape[:2]
+
+    data, stage = None, 'miss'
+    with dec['lock']:
+        detector = dec['detector']
+        # 1. 직전 프레임의 QR 위치 주변만 잘라서 시도
+        if dec['roi'] is not None:
+            t = time.perf_counter()
+            x0, y0, x1, y1 = dec['roi']
+            ox, oy = int(x0 * w), int(y0 * h)
+            crop = img[oy:int(y1 * h), ox:int(x1 * w)]
+            if crop.size:
+                data, points, _ = detector.detectAndDecode(crop)
+                if data and points is not None:
+                    stage = 'roi'
+                    pts = points.reshape(-1, 2) + (ox, oy)
+                    dec['roi'] = _qr_points_to_roi(pts, 1.0, w, h)
+            timings['roi'] = time.perf_counter() - t
+
+        # 2. 작은 해상도부터 차례로 시도
+        if not data:
+            t = time.perf_counter()
+            for target_w in QR_PYRAMID_WIDTHS:
+                if w <= target_w: break
+                scale = target_w / w
+                small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                data, points, _ = detector.detectAndDecode(small)
+                if data and points is not None:
+                    stage = 'pyramid'
+                    dec['roi'] = _qr_points_to_roi(points, scale, w, h)
+                    break
+            timings['pyramid'] = time.perf_counter() - t
+
+        # 3. 마지막으로 원본 해상도
+        if not data:
+            t = time.perf_counter()
+            data, points, _ = detector.detectAndDecode(img)
+            if data and points is not None:
+                stage = 'full'
+                dec['roi'] = _qr_points_to_roi(points, 1.0, w, h)
+            else:
+                dec['roi'] = None
+            timings['full'] = time.perf_counter() - t
+
+        timings['total'] = time.perf_counter() - t_start
+        for s, sec in timings.items(): dec['timings'][s].append(sec * 1000)
+        dec['hits'][stage] += 1
+    return data if data else None
 
 def decode_qr(image_input):
     try:
         if image_input is None: return None
-        bytes_data = image_input.getvalue()
-        img = cv2.imdecode(np.frombuffer(bytes_data, np.uint8), cv2.IMREAD_COLOR)
-        detector = cv2.QRCodeDetector()
-        data, _, _ = detector.detectAndDecode(img)
-        return data if data else None
+        return decode_qr_bytes(image_input.getvalue())
     except: return None
 
+def get_qr_timing_stats():
+    """
+    단계별 소요 시간(ms) 평균/p95와 어느 단계에서 인식됐는지 횟수
+    """
+    dec = get_qr_decoder()
+    with dec['lock']:
+        rows = []
+        for s in QR_STAGES:
+            vals = np.array(dec['timings'][s])
+            if len(vals): rows.append({'단계': s, '횟수': len(vals), '평균(ms)': round(float(vals.mean()), 1),
+                                       'p95(ms)': round(float(np.percentile(vals, 95)), 1)})
+        return pd.DataFrame(rows), dict(dec['hits'])
+
+def benchmark_qr_decoder(image_paths, reuse_roi=True):
+    """
+    저장된 샘플 프레임들로 인식 속도 측정 (reuse_roi=False면 매 프레임 ROI 없이 시작)
+    """
+    dec = get_qr_decoder()
+    results = []
+    for path in image_paths:
+        with open(path, 'rb') as f: bytes_data = f.read()
+        if not reuse_roi:
+            with dec['lock']: dec['roi'] = None
+        t = time.perf_counter()
+        data = decode_qr_bytes(bytes_data)
+        results.append({'파일': os.path.basename(path), '결과': data or "", 'ms': round((time.perf_counter() - t) * 1000, 1)})
+    return pd.DataFrame(results)
+
+# 앱 시작 시 출석 대기열 워커 실행 (재시작 전에 남은 기록도 전송)
+get_attendance_queue()
+
 # ==========================================
 # [메뉴] 사이드바 구성
 # ==========================================
@@ -308,10 +2253,10 @@ with st.sidebar:
     
     menu = option_menu("메뉴 선택", 
         ["1. 강사 관리", "2. 학생 관리", "3. 반 관리", "4. 수강 배정", 
-         "5. 출석 관리", "6. 상담 관리", "7. 강사별 시간표", "8. 강의실별 시간표", 
-         "9. 학생 개인별 종합", "10. QR 키오스크(출석)"], 
+         "5. 출석 관리", "6. 데이터 통합 조회", "7. 강사별 시간표", "8. 강의실별 시간표", 
+         "9. 학생 개인별 종합", "10. QR 키오스크(출석)", "11. 출석 통계"], 
         icons=['person-video3', 'backpack', 'easel', 'journal-check', 
-               'calendar-check', 'chat-dots', 'clock', 'building', 'card-checklist', 'qr-code-scan'],
+               'calendar-check', 'table', 'clock', 'building', 'card-checklist', 'qr-code-scan', 'bar-chart-line'],
         menu_icon="cast", default_index=0,
         styles={
             "container": {"padding": "0!important", "background-color": "#f0f2f6"},
@@ -327,6 +2272,28 @@ with st.sidebar:
         }
     )
     st.markdown("---")
+    with st.expander("📡 API 사용량"):
+        st.caption(f"저장소: {STORAGE_BACKEND}")
+        if STORAGE_BACKEND == "snapshot":
+            snap_store = get_snapshot_store()
+            if snap_store['path']: st.caption(f"📦 읽기 전용 스냅샷: {os.path.basename(snap_store['path'])} ({snap_store['manifest'].get('created_at', '')})")
+            else: st.caption(f"⚠️ '{SNAPSHOT_DIR}'에 스냅샷이 없습니다.")
+        api = get_api_stats()
+        st.progress(min(api['last_min'] / max(api['quota'], 1), 1.0), text=f"최근 1분: {api['last_min']} / {api['quota']}회")
+        st.caption(f"누적 호출 {api['calls']}회 · 재시도 {api['retries']}회 · 실패 {api['fatal']}회")
+        st.caption(f"대기 시간 {api['wait_sec']:.1f}초 (한도 대기 {api['throttled']}회)")
+        if USE_MIRROR:
+            mirror_state = get_mirror()
+            synced = [mirror_synced_at(s) for s in MIRROR_SHEETS]
+            last_sync = min(synced) if all(synced) else 0
+            st.caption(f"🗄️ 로컬 미러: {datetime.fromtimestamp(last_sync).strftime('%H:%M:%S') + ' 동기화' if last_sync else '준비 중'}")
+            if mirror_state['last_error']: st.caption(f"⚠️ 동기화 오류: {mirror_state['last_error']}")
+            if st.button("🔄 미러 전체 동기화", use_container_width=True):
+                try:
+                    sync_mirror(full=True)
+                    for s in MIRROR_SHEETS: clear_cache(s)
+                    mirror_state['last_error'] = None
+                except Exception as e: mirror_state['last_error'] = str(e)
     st.caption("Developed by 형설지공 2026")
 
 # ==========================================================
@@ -359,10 +2326,9 @@ if menu == "1. 강사 관리":
 
     # [Tab 2] 수정 및 삭제
     with tab2:
-        df_t = load_data('teachers')
+        df_t = load_typed(['teachers'])['teachers']
         if not df_t.empty:
-            t_names = get_col_data(df_t, '이름', 0).astype(str)
-            t_options = t_names.tolist()
+            t_options = df_t['이름'].tolist()
             
             idx = st.session_state.get('t_modify_idx', 0)
             if idx >= len(t_options): idx = 0
@@ -371,15 +2337,13 @@ if menu == "1. 강사 관리":
             if selected_t in t_options: st.session_state['t_modify_idx'] = t_options.index(selected_t)
             
             if selected_t:
-                row = df_t[df_t[df_t.columns[0]] == selected_t].iloc[0]
+                row = df_t[df_t['이름'] == selected_t].iloc[0]
                 
                 st.divider()
                 st.markdown(f"##### 🔧 '{selected_t}' 선생님 정보 수정")
                 
-                prev_name = row.iloc[0]
-                prev_sub = row.iloc[1] if len(row) > 1 else ""
-                prev_ph = row.iloc[2] if len(row) > 2 else ""
-                prev_email = row.iloc[3] if len(row) > 3 else ""
+                prev_name, prev_sub = row['이름'], str(row['과목'])
+                prev_ph, prev_email = row['연락처'], row['이메일']
 
                 n_name = st.text_input("이름", value=prev_name, key="edit_t_n")
                 n_sub = st.text_input("과목", value=prev_sub, key="edit_t_s")
@@ -431,13 +2395,14 @@ if menu == "1. 강사 관리":
 # ==========================================
 elif menu == "2. 학생 관리":
     st.subheader("📝 학생 관리")
-    t1, t2, t3, t4 = st.tabs(["📋 전체 학생 조회", "➕ 신규 등록", "🔧 수정/삭제", "📱 QR 발급/인쇄"])
+    t1, t2, t3, t4, t5 = st.tabs(["📋 전체 학생 조회", "➕ 신규 등록", "🔧 수정/삭제", "📱 QR 발급/인쇄", "📥 일괄 등록"])
     
-    df_c, df_t, df_s = load_data('classes'), load_data('teachers'), load_data('students')
-    all_subjects = sorted(get_col_data(df_t, '과목', 1).unique().tolist()) if not df_t.empty else []
+    snap = load_typed(['classes', 'teachers', 'students'])
+    df_c, df_t, df_s = snap['classes'], snap['teachers'], snap['students']
+    all_subjects = sorted(df_t['과목'].unique().tolist()) if not df_t.empty else []
 
     with t1:
-        st.dataframe(df_s, use_container_width=True)
+        st.dataframe(visible_cols(df_s), use_container_width=True)
 
     with t2:
         if df_c.empty: st.warning("⚠️ 개설된 반이 없습니다.")
@@ -454,7 +2419,7 @@ elif menu == "2. 학생 관리":
         final_enroll_list = []
         for subj in all_subjects:
             if st.checkbox(f"📘 {subj} 수강", key=f"new_chk_{subj}"):
-                sub_teachers = df_t[df_t.iloc[:, 1] == subj].iloc[:, 0].tolist()
+                sub_teachers = df_t.loc[df_t['과목'] == subj, '이름'].tolist()
                 c_tea, c_cls = st.columns([1, 2])
                 with c_tea:
                     sel_teas = st.multiselect(f"담당 선생님 ({subj})", sub_teachers, key=f"new_tea_{subj}")
@@ -462,11 +2427,10 @@ elif menu == "2. 학생 관리":
                     cls_options = []
                     cls_map = {}
                     for tea in sel_teas:
-                        t_classes = df_c[df_c.iloc[:, 1].str.contains(tea)]
-                        for _, r in t_classes.iterrows():
-                            lbl = f"{r.iloc[0]} ({r.iloc[2]})"
+                        t_classes = df_c[df_c['선생님'].str.contains(tea)]
+                        for lbl, c_name, c_tea in zip(t_classes['_label'], t_classes['반이름'], t_classes['선생님']):
                             cls_options.append(lbl)
-                            cls_map[lbl] = {'반이름': r.iloc[0], '담당강사': r.iloc[1]}
+                            cls_map[lbl] = {'반이름': c_name, '담당강사': c_tea}
                     with c_cls:
                         sel_cls_labels = st.multiselect(f"배정할 반 ({subj})", cls_options, key=f"new_cls_{subj}")
                         for lbl in sel_cls_labels:
@@ -493,28 +2457,27 @@ elif menu == "2. 학생 관리":
         if not df_s.empty:
             st.markdown("### 🔍 학생 검색 및 수정")
             k = st.text_input("이름 검색", key='s_search_edit')
-            df_s['L'] = df_s.iloc[:,0] + " (" + df_s.iloc[:,3] + ")"
-            f = df_s[df_s.iloc[:,0].str.contains(k)] if k else df_s
+            f = df_s[df_s['이름'].str.contains(k)] if k else df_s
             
-            s_ops = f['L'].tolist()
+            s_ops = f['_label_grade'].tolist()
             s_sel = st.selectbox("학생 선택", s_ops)
             
             if s_sel:
                 real_n = s_sel.split(' (')[0]
-                row = df_s[df_s.iloc[:,0] == real_n].iloc[0]
+                row = df_s[df_s['이름'] == real_n].iloc[0]
                 
                 st.divider()
                 st.markdown(f"##### 🔧 '{real_n}' 학생 정보 수정")
                 
                 sc1, sc2 = st.columns(2)
-                u_nm = sc1.text_input("이름", value=row.iloc[0], key=f"u_sn_{real_n}")
-                u_hp = sc1.text_input("학생 폰", value=row.iloc[1], key=f"u_sp_{real_n}")
-                u_pp = sc1.text_input("부모 폰", value=row.iloc[2], key=f"u_spp_{real_n}")
+                u_nm = sc1.text_input("이름", value=row['이름'], key=f"u_sn_{real_n}")
+                u_hp = sc1.text_input("학생 폰", value=row['연락처'], key=f"u_sp_{real_n}")
+                u_pp = sc1.text_input("부모 폰", value=row['학부모연락처'], key=f"u_spp_{real_n}")
                 
                 grs = ["초4","초5","초6","중1","중2","중3","고1","고2","고3"]
-                cur_g = row.iloc[3]
+                cur_g = str(row['학년'])
                 u_gr = sc2.selectbox("학년", grs, index=grs.index(cur_g) if cur_g in grs else 0, key=f"u_sg_{real_n}")
-                u_sc = sc2.text_input("학교", value=row.iloc[4], key=f"u_ssc_{real_n}")
+                u_sc = sc2.text_input("학교", value=str(row['학교']), key=f"u_ssc_{real_n}")
 
                 bc1, bc2 = st.columns(2)
                 
@@ -541,8 +2504,7 @@ elif menu == "2. 학생 관리":
                     st.error(f"⚠️ 경고: '{real_n}' 학생을 삭제하면 수강 기록까지 모두 사라집니다.")
                     col_y, col_n = st.columns([1,1])
                     if col_y.button("네, 모두 삭제합니다", type="primary"):
-                        delete_data_all('students', {'이름': real_n})
-                        delete_data_all('enrollments', {'학생': real_n})
+                        delete_cascade([('students', {'이름': real_n}), ('enrollments', {'학생': real_n})])
                         st.session_state['confirm_action'] = None
                         show_center_message("삭제 완료", icon="🗑️")
                         time.sleep(1); st.rerun()
@@ -552,28 +2514,79 @@ elif menu == "2. 학생 관리":
 
     with t4:
         st.markdown("### 📱 QR 코드 발급 및 인쇄")
-        df = load_data('students')
-        if not df.empty:
-            s = st.selectbox("학생 선택", df.iloc[:,0], key='qr_sel_main')
+        if not df_s.empty:
+            s = st.selectbox("학생 선택", df_s['이름'], key='qr_sel_main')
             if s:
-                row = df[df.iloc[:,0]==s].iloc[0]
-                ph = str(row.iloc[1])[-4:] if len(row)>1 else "0000"
-                img = generate_styled_qr(f"{s}/{ph}", s)
+                row = df_s[df_s['이름'] == s].iloc[0]
+                byte_im = get_qr_card_png(qr_payload(s, row['연락처']), s)
                 c_qr1, c_qr2 = st.columns([1, 1.5])
-                with c_qr1: st.image(img, caption=f"{s} 학생 QR", width=300)
+                with c_qr1: st.image(byte_im, caption=f"{s} 학생 QR", width=300)
                 with c_qr2:
                     st.success(f"✅ **{s}** 학생의 QR코드가 생성되었습니다.")
                     st.markdown("**🖨️ 인쇄:** `Ctrl + P`를 눌러 인쇄하세요.")
                     st.divider()
-                    buf = io.BytesIO(); img.save(buf, format="PNG"); byte_im = buf.getvalue()
                     st.download_button("💾 이미지 다운로드", data=byte_im, file_name=f"형설지공_{s}_QR.png", mime="image/png", type="primary")
 
+            st.divider()
+            st.markdown("### 🗂️ QR 카드 일괄 발급")
+            qc1, qc2, qc3 = st.columns([2, 2, 1])
+            sel_grades = qc1.multiselect("학년 (비우면 전체)", sorted(df_s['학년'].unique().tolist()), key='qr_bulk_grade')
+            school_kw = qc2.text_input("학교 검색", key='qr_bulk_school')
+            out_fmt = qc3.radio("형식", ["PDF (A4)", "ZIP (PNG)"], key='qr_bulk_fmt')
+            targets = df_s
+            if sel_grades: targets = targets[targets['학년'].isin(sel_grades)]
+            if school_kw: targets = targets[targets['학교'].astype(str).str.contains(school_kw)]
+            st.caption(f"대상 학생: {len(targets)}명")
+            if st.button("🖨️ 카드 만들기", disabled=targets.empty):
+                with st.spinner("QR 카드 생성 중..."):
+                    pairs = list(zip(targets['이름'], targets['연락처']))
+                    is_pdf = out_fmt.startswith("PDF")
+                    st.session_state['qr_bulk_file'] = (export_qr_cards(pairs, "pdf" if is_pdf else "zip"), is_pdf)
+            if st.session_state.get('qr_bulk_file'):
+                data, is_pdf = st.session_state['qr_bulk_file']
+                st.download_button("💾 일괄 다운로드", data=data, file_name=f"형설지공_QR카드.{'pdf' if is_pdf else 'zip'}",
+                                   mime="application/pdf" if is_pdf else "application/zip", type="primary")
+
+    with t5:
+        st.markdown("### 📥 CSV/엑셀로 학생 일괄 등록")
+        st.caption(f"첫 줄 헤더: {', '.join(IMPORT_COLS)} (반이름은 여러 개면 쉼표로 구분, 과목/담당강사는 반 정보에서 채움)")
+        template = pd.DataFrame([["홍길동", "010-1234-5678", "010-8765-4321", "중1", "형설중", ", ".join(df_c['반이름'].astype(str).head(2))]], columns=IMPORT_COLS)
+        st.download_button("📄 양식 받기 (CSV)", data=template.to_csv(index=False).encode("utf-8-sig"), file_name="학생_일괄등록_양식.csv", mime="text/csv")
+        up = st.file_uploader("파일 선택", type=["csv", "xlsx"], key="import_file")
+        if st.session_state.get('import_result'):
+            st.success(st.session_state.pop('import_result'))
+        if up is not None:
+            data = up.getvalue()
+            ib1, ib2 = st.columns(2)
+            if ib1.button("🔎 미리 검사 (저장 안 함)", use_container_width=True):
+                try:
+                    snap_i = load_snapshot(['students', 'classes', 'enrollments'], copy=False)
+                    st.session_state['import_report'] = plan_import(data, up.name, snap_i['students'], snap_i['classes'], snap_i['enrollments'])[0]
+                except Exception as e: st.error(f"파일을 읽을 수 없습니다: {e}")
+            if ib2.button("📥 가져오기 실행", type="primary", use_container_width=True):
+                bar = st.progress(0.0, text="가져오는 중...")
+                try:
+                    report, n_s, n_e = run_import(data, up.name, on_progress=lambda done, total: bar.progress(done / total, text=f"가져오는 중... ({done}/{total})"))
+                    st.session_state['import_report'] = report
+                    st.session_state['import_result'] = f"✅ 학생 {n_s}명, 수강 {n_e}건 추가 (오류/중복 {int(report['상태'].isin(['오류', '중복']).sum())}건 제외)"
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"가져오기 중단: {e}\n\n같은 파일로 다시 실행하면 이미 들어간 행은 건너뛰고 이어서 진행합니다.")
+            report = st.session_state.get('import_report')
+            if report is not None:
+                counts = report['상태'].value_counts()
+                m1, m2, m3, m4 = st.columns(4)
+                for col, label in zip((m1, m2, m3, m4), ("신규", "기존 학생", "중복", "오류")): col.metric(label, f"{int(counts.get(label, 0))}건")
+                problems = report[report['상태'].isin(['오류', '중복'])]
+                if not problems.empty: st.dataframe(problems, use_container_width=True, hide_index=True)
+                with st.expander(f"전체 검사 결과 ({len(report)}행)"): st.dataframe(report, use_container_width=True, hide_index=True)
+
 # ==========================================
 # 3. 반 관리
 # ==========================================
 elif menu == "3. 반 관리":
     st.subheader("📚 반 관리")
-    tab1, tab2 = st.tabs(["➕ 반 개설", "🔧 반 정보 수정/삭제"])
+    tab1, tab2, tab3 = st.tabs(["➕ 반 개설", "🔧 반 정보 수정/삭제", "⚠️ 시간 충돌 점검"])
     
     days = ["월", "화", "수", "목", "금", "토", "일"]
     day_colors = {"월":"#FFEBEE", "화":"#FFF3E0", "수":"#E8F5E9", "목":"#E3F2FD", "금":"#F3E5F5", "토":"#FAFAFA", "일":"#FFEBEE"}
@@ -581,19 +2594,48 @@ elif menu == "3. 반 관리":
     mins = ["00분", "10분", "20분", "30분", "40분", "50분"]
     rooms = ["기타", "101호", "102호", "103호", "104호"]
 
+    def apply_slot(slot):
+        # 찾은 빈 시간을 아래 요일/시간 선택칸에 채움 (위젯 생성 전에 실행되는 on_click 콜백)
+        sh, sm = slot['시작'].split(':'); eh, em = slot['끝'].split(':')
+        for day in days: st.session_state[f"new_chk_{day}"] = (day == slot['요일'])
+        st.session_state.update({f"new_sh_{slot['요일']}": f"{int(sh)}시", f"new_sm_{slot['요일']}": f"{sm}분",
+                                 f"new_eh_{slot['요일']}": f"{int(eh)}시", f"new_em_{slot['요일']}": f"{em}분",
+                                 "new_c_room": slot['강의실']})
+
     with tab1:
-        df_t = load_data('teachers')
+        snap = load_typed(['teachers', 'students'])
+        df_t, df_s = snap['teachers'], snap['students']
         if df_t.empty: st.warning("선생님을 먼저 등록해주세요.")
         else:
-            t_opts = (get_col_data(df_t, '이름', 0) + " (" + get_col_data(df_t, '과목', 1) + ")").tolist()
+            t_opts = df_t['_label'].tolist()
             c1, c2, c3 = st.columns([2, 1, 2])
             c_name = c1.text_input("반 이름", key="new_c_name")
             c_room = c2.selectbox("강의실", rooms, key="new_c_room")
             t_name = c3.selectbox("담당 선생님", t_opts, key="new_t_name")
+
+            with st.expander("🧭 빈 시간 찾기 (강사/학생/강의실이 모두 비는 시간)"):
+                f1, f2 = st.columns([1, 3])
+                f_dur = f1.number_input("수업 길이(분)", min_value=30, max_value=240, value=90, step=SLOT_STEP, key="slot_dur")
+                f_days = f2.multiselect("가능한 요일", days, default=days[:5], key="slot_days")
+                f_rooms = st.multiselect("선호 강의실 (고른 순서대로 우선)", rooms, default=rooms[1:], key="slot_rooms")
+                f_students = st.multiselect("꼭 들어야 하는 학생", df_s['이름'].tolist() if not df_s.empty else [], key="slot_students")
+                if st.button("🔍 빈 시간 찾기", key="slot_find"):
+                    cf_snap = load_snapshot(['classes', 'enrollments'], copy=False)
+                    st.session_state['slot_results'] = find_free_slots(get_conflict_index(cf_snap['classes'], cf_snap['enrollments']),
+                                                                       t_name, int(f_dur), f_days, f_rooms, f_students)
+                df_slots = st.session_state.get('slot_results')
+                if df_slots is not None:
+                    if df_slots.empty: st.warning("조건을 만족하는 시간이 없습니다. 요일/강의실/학생 조건을 줄여보세요.")
+                    else:
+                        st.dataframe(visible_cols(df_slots), use_container_width=True, hide_index=True)
+                        pick = st.selectbox("적용할 시간", range(len(df_slots)), key="slot_pick",
+                                            format_func=lambda i: f"{df_slots.at[i, '시간']} · {df_slots.at[i, '강의실']}")
+                        st.button("⬇️ 이 시간으로 채우기", key="slot_apply", on_click=apply_slot, args=(df_slots.loc[pick].to_dict(),))
             
             st.write("🕒 **요일 및 시간 설정**")
             schedule_data = {}
             for day in days:
+                st.session_state.setdefault(f"new_eh_{day}", hours[1]) # 기본 종료 시각 (빈 시간 찾기로 채울 수 있게 index 대신 세션 값으로)
                 d_c1, d_c2, d_c3, d_c4, d_c5, d_c6 = st.columns([1, 2, 2, 0.5, 2, 2])
                 with d_c1:
                     chk_col, badge_col = st.columns([0.3, 0.7])
@@ -602,34 +2644,40 @@ elif menu == "3. 반 관리":
                 with d_c2: sh = st.selectbox("시", hours, key=f"new_sh_{day}", label_visibility="collapsed", disabled=not is_chk)
                 with d_c3: sm = st.selectbox("분", mins, key=f"new_sm_{day}", label_visibility="collapsed", disabled=not is_chk)
                 with d_c4: st.write("~")
-                with d_c5: eh = st.selectbox("시", hours, index=1, key=f"new_eh_{day}", label_visibility="collapsed", disabled=not is_chk)
+                with d_c5: eh = st.selectbox("시", hours, key=f"new_eh_{day}", label_visibility="collapsed", disabled=not is_chk)
                 with d_c6: em = st.selectbox("분", mins, key=f"new_em_{day}", label_visibility="collapsed", disabled=not is_chk)
                 if is_chk:
                     schedule_data[day] = f"{sh.replace('시',':')}{sm.replace('분','')}-{eh.replace('시',':')}{em.replace('분','')}"
 
+            force_new = st.checkbox("시간이 겹쳐도 저장", key="new_c_force")
             if st.button("반 만들기 (저장)", type="primary"):
+                final_sche = [f"{d} {t}" for d, t in schedule_data.items()]
+                cf_snap = load_snapshot(['classes', 'enrollments'], copy=False)
+                conflicts = check_class_conflicts(get_conflict_index(cf_snap['classes'], cf_snap['enrollments']),
+                                                  ", ".join(final_sche), t_name, c_room)
                 if not c_name: st.error("반 이름을 입력해주세요.")
                 elif not schedule_data: st.error("요일을 최소 하나 이상 선택해주세요.")
+                elif conflicts and not force_new:
+                    st.error("시간이 겹치는 수업이 있습니다.\n\n" + "\n".join(f"- {m}" for m in conflicts))
                 else:
-                    final_sche = [f"{d} {t}" for d, t in schedule_data.items()]
                     add_data('classes', {'반이름': c_name, '선생님': t_name, '시간': ", ".join(final_sche), '강의실': c_room})
                     show_center_message(f"'{c_name}' 개설 완료!")
                     time.sleep(1); st.rerun()
 
     with tab2:
-        df_c = load_data('classes')
-        df_t = load_data('teachers')
+        snap = load_typed(['classes', 'teachers'])
+        df_c, df_t = snap['classes'], snap['teachers']
         if df_c.empty: st.info("개설된 반이 없습니다.")
         else:
-            t_opts = (get_col_data(df_t, '이름', 0) + " (" + get_col_data(df_t, '과목', 1) + ")").tolist() if not df_t.empty else []
-            c_opts = df_c.iloc[:, 0].tolist()
+            t_opts = df_t['_label'].tolist()
+            c_opts = df_c['반이름'].tolist()
             sel_c_name = st.selectbox("수정할 반 선택", c_opts)
             
             if sel_c_name:
-                curr_row = df_c[df_c.iloc[:, 0] == sel_c_name].iloc[0]
-                curr_teacher = str(curr_row.iloc[1])
-                curr_schedule_str = str(curr_row.iloc[2])
-                curr_room = str(curr_row.iloc[3]) if len(curr_row) > 3 else "기타"
+                curr_row = df_c[df_c['반이름'] == sel_c_name].iloc[0]
+                curr_teacher = str(curr_row['선생님'])
+                curr_schedule_str = str(curr_row['시간'])
+                curr_room = str(curr_row['강의실'])
                 if curr_room not in rooms: curr_room = "기타"
                 curr_sche_map = {}
                 for p in curr_schedule_str.split(','):
@@ -681,12 +2729,22 @@ elif menu == "3. 반 관리":
                 if st.session_state.get('confirm_action') == 'update_class':
                     st.warning(f"⚠️ '{sel_c_name}' 반 정보를 수정하시겠습니까?")
                     col_y, col_n = st.columns([1,1])
+                    force_edit = st.checkbox("시간이 겹쳐도 저장", key=f"edit_force_{sel_c_name}")
                     if col_y.button("네, 수정합니다", type="primary"):
                         nd = {'반이름': u_c_name, '선생님': u_t_name, '시간': ", ".join(u_updated_sche), '강의실': u_room}
-                        update_data('classes', '반이름', sel_c_name, nd)
-                        st.session_state['confirm_action'] = None
-                        show_center_message("수정 완료!")
-                        time.sleep(1); st.rerun()
+                        cf_snap = load_snapshot(['classes', 'enrollments'], copy=False)
+                        cf_idx = get_conflict_index(cf_snap['classes'], cf_snap['enrollments'])
+                        conflicts = check_class_conflicts(cf_idx, nd['시간'], u_t_name, u_room, ignore_class=sel_c_name)
+                        new_slots = schedule_slots(nd['시간'])
+                        for std_name, _, _ in get_roster_index(cf_snap['enrollments'], load_snapshot(['students'], copy=False)['students']).get(sel_c_name, []):
+                            conflicts += check_student_conflicts(cf_idx, std_name, sel_c_name, slots=new_slots)
+                        if conflicts and not force_edit:
+                            st.error("시간이 겹치는 수업이 있습니다.\n\n" + "\n".join(f"- {m}" for m in conflicts))
+                        else:
+                            update_data('classes', '반이름', sel_c_name, nd)
+                            st.session_state['confirm_action'] = None
+                            show_center_message("수정 완료!")
+                            time.sleep(1); st.rerun()
                     if col_n.button("취소"):
                         st.session_state['confirm_action'] = None
                         st.rerun()
@@ -698,8 +2756,7 @@ elif menu == "3. 반 관리":
                     st.error(f"⚠️ 경고: '{sel_c_name}' 반을 삭제하면 소속된 학생들의 수강 기록도 모두 삭제됩니다.")
                     col_y, col_n = st.columns([1,1])
                     if col_y.button("네, 삭제합니다", type="primary"):
-                        delete_data_all('classes', {'반이름': sel_c_name})
-                        delete_data_all('enrollments', {'반이름': sel_c_name})
+                        delete_cascade([('classes', {'반이름': sel_c_name}), ('enrollments', {'반이름': sel_c_name})])
                         st.session_state['confirm_action'] = None
                         show_center_message("삭제 완료!", icon="🗑️")
                         time.sleep(1); st.rerun()
@@ -707,19 +2764,29 @@ elif menu == "3. 반 관리":
                         st.session_state['confirm_action'] = None
                         st.rerun()
 
+    with tab3:
+        cf_snap = load_snapshot(['classes', 'enrollments'], copy=False)
+        df_audit = audit_conflicts(get_conflict_index(cf_snap['classes'], cf_snap['enrollments']))
+        if df_audit.empty: st.success("겹치는 수업이 없습니다.")
+        else:
+            counts = df_audit['종류'].value_counts()
+            m1, m2, m3 = st.columns(3)
+            for col, (_, label) in zip((m1, m2, m3), CONFLICT_KINDS): col.metric(f"{label} 충돌", f"{int(counts.get(label, 0))}건")
+            st.dataframe(df_audit, use_container_width=True, hide_index=True)
+
 # ==========================================
 # 4. 수강 배정
 # ==========================================
 elif menu == "4. 수강 배정":
     st.subheader("🔗 수강 배정 관리")
     
-    df_e = load_data('enrollments')
-    df_s = load_data('students')
-    df_t = load_data('teachers')
-    df_c = load_data('classes')
+    snap = load_typed(['enrollments', 'students', 'teachers', 'classes'])
+    df_e, df_s, df_t, df_c = snap['enrollments'], snap['students'], snap['teachers'], snap['classes']
 
     if 'draft_enrolls' not in st.session_state:
         st.session_state.draft_enrolls = []
+    if 'draft_keys' not in st.session_state:
+        st.session_state.draft_keys = {enrollment_key(item) for item in st.session_state.draft_enrolls}
     if 'confirm_save_cart' not in st.session_state:
         st.session_state.confirm_save_cart = False
     if 'confirm_cancel_target' not in st.session_state:
@@ -732,7 +2799,8 @@ elif menu == "4. 수강 배정":
             st.info("현재 배정된 수강 내역이 없습니다.")
         else:
             try:
-                st.dataframe(df_e[['학생', '과목', '반이름', '담당강사', '날짜']], use_container_width=True)
+                st.dataframe(df_e[['학생', '과목', '반이름', '담당강사', '날짜']], use_container_width=True,
+                             column_config={'날짜': st.column_config.DateColumn(format="YYYY-MM-DD")})
             except:
                 st.warning("구글 시트 헤더가 [학생, 과목, 반이름, 담당강사, 날짜] 순서인지 확인해주세요.")
 
@@ -744,23 +2812,22 @@ elif menu == "4. 수강 배정":
             
             with c_left:
                 st.markdown("### 1️⃣ 학생 선택")
-                df_s['L'] = df_s.iloc[:,0] + " (" + df_s.iloc[:,4] + ")" 
-                s_list = df_s['L'].tolist()
+                s_list = df_s['_label'].tolist()
                 sel_student_label = st.selectbox("학생을 선택하세요", s_list, key="assign_sel_std")
 
                 if sel_student_label:
-                    real_name = sel_student_label.split(' (')[0]
-                    s_info = df_s[df_s.iloc[:,0] == real_name].iloc[0]
-                    st.success(f"👤 **{s_info.iloc[0]}** ({s_info.iloc[3]})")
+                    s_info = df_s.iloc[get_label_index('students', df_s)[sel_student_label]]
+                    real_name = str(s_info['이름'])
+                    st.success(f"👤 **{s_info['이름']}** ({s_info['학년']})")
                     
                     st.divider()
                     st.markdown("### 2️⃣ 수업 담기")
                     
-                    all_subjects = sorted(get_col_data(df_t, '과목', 1).unique().tolist())
+                    all_subjects = sorted(df_t['과목'].unique().tolist())
                     sel_subj = st.selectbox("과목 선택", ["(선택하세요)"] + all_subjects)
                     
                     if sel_subj != "(선택하세요)":
-                        sub_teachers = df_t[df_t.iloc[:, 1] == sel_subj].iloc[:, 0].tolist()
+                        sub_teachers = df_t.loc[df_t['과목'] == sel_subj, '이름'].tolist()
                         if not sub_teachers:
                             st.error("해당 과목의 강사가 없습니다.")
                             sel_tea = None
@@ -768,34 +2835,28 @@ elif menu == "4. 수강 배정":
                             sel_tea = st.selectbox("강사 선택", ["(선택하세요)"] + sub_teachers)
                         
                         if sel_tea and sel_tea != "(선택하세요)":
-                            t_classes = df_c[df_c.iloc[:, 1].str.contains(sel_tea)]
+                            t_classes = df_c[df_c['선생님'].str.contains(sel_tea)]
                             if t_classes.empty:
                                 st.error("해당 강사의 개설된 반이 없습니다.")
                                 sel_cls_full = None
                             else:
-                                cls_opts = [f"{r.iloc[0]} ({r.iloc[2]})" for _, r in t_classes.iterrows()]
+                                cls_opts = t_classes['_label'].tolist()
                                 sel_cls_full = st.selectbox("반 선택", ["(선택하세요)"] + cls_opts)
                                 
                                 if sel_cls_full and sel_cls_full != "(선택하세요)":
                                     real_cls_name = sel_cls_full.split(' (')[0]
                                     if st.button("⬇️ 장바구니에 담기", type="primary"):
-                                        is_exist = False
-                                        for item in st.session_state.draft_enrolls:
-                                            if item['학생'] == real_name and item['반이름'] == real_cls_name and item['과목'] == sel_subj:
-                                                is_exist = True
-                                        
-                                        if not df_e.empty:
-                                            try:
-                                                already = df_e[
-                                                    (df_e.iloc[:,0]==real_name) & 
-                                                    (df_e.iloc[:,1]==sel_subj) & 
-                                                    (df_e.iloc[:,2]==real_cls_name)
-                                                ]
-                                                if not already.empty: is_exist = True
-                                            except: pass
+                                        new_key = (real_name, str(sel_subj), real_cls_name)
+                                        is_exist = new_key in st.session_state.draft_keys or new_key in get_enrollment_keys(df_e)
+
+                                        cf_idx = get_conflict_index(df_c, df_e)
+                                        cart_cls = [item['반이름'] for item in st.session_state.draft_enrolls if item['학생'] == real_name]
+                                        conflicts = [] if is_exist else check_student_conflicts(cf_idx, real_name, real_cls_name, cart_cls)
 
                                         if is_exist:
                                             st.warning("이미 담겼거나 수강 중인 수업입니다.")
+                                        elif conflicts:
+                                            st.error("이미 듣는 수업과 시간이 겹칩니다.\n\n" + "\n".join(f"- {m}" for m in conflicts))
                                         else:
                                             st.session_state.draft_enrolls.append({
                                                 '학생': real_name,
@@ -804,6 +2865,7 @@ elif menu == "4. 수강 배정":
                                                 '담당강사': sel_tea,
                                                 '날짜': str(datetime.today().date())
                                             })
+                                            st.session_state.draft_keys.add(new_key)
                                             st.rerun()
 
             with c_right:
@@ -815,6 +2877,7 @@ elif menu == "4. 수강 배정":
                             cc1, cc2 = st.columns([4, 1])
                             cc1.markdown(f"**{item['학생']}** - :blue[[{item['과목']}]] {item['반이름']} ({item['담당강사']})")
                             if cc2.button("삭제", key=f"draft_del_{i}"):
+                                st.session_state.draft_keys.discard(enrollment_key(item))
                                 del st.session_state.draft_enrolls[i]
                                 st.rerun()
                     
@@ -829,11 +2892,25 @@ elif menu == "4. 수강 배정":
                         col_y, col_n = st.columns([1, 1])
                         
                         if col_y.button("네, 저장합니다", type="primary", use_container_width=True):
-                            add_data_bulk('enrollments', st.session_state.draft_enrolls)
-                            st.session_state.draft_enrolls = []
-                            st.session_state.confirm_save_cart = False
-                            show_center_message("✅ 배정 완료!")
-                            time.sleep(1.5); st.rerun()
+                            # 저장 직전 최신 스냅샷으로 중복/시간 충돌을 로컬에서 다시 확인한 뒤 한 번에 추가
+                            fresh = load_snapshot(['enrollments', 'classes'], copy=False)
+                            saved_keys = get_enrollment_keys(fresh['enrollments'])
+                            cart_new = [item for item in st.session_state.draft_enrolls if enrollment_key(item) not in saved_keys]
+                            cf_idx = get_conflict_index(fresh['classes'], fresh['enrollments'])
+                            conflicts, seen = [], {}
+                            for item in cart_new:
+                                conflicts += check_student_conflicts(cf_idx, item['학생'], item['반이름'], seen.get(item['학생'], []))
+                                seen.setdefault(item['학생'], []).append(item['반이름'])
+                            if conflicts:
+                                st.error("시간이 겹치는 수업이 있습니다.\n\n" + "\n".join(f"- {m}" for m in conflicts))
+                            else:
+                                if cart_new: add_data_bulk('enrollments', cart_new)
+                                skipped = len(st.session_state.draft_enrolls) - len(cart_new)
+                                st.session_state.draft_enrolls = []
+                                st.session_state.draft_keys = set()
+                                st.session_state.confirm_save_cart = False
+                                show_center_message(f"✅ 배정 완료! ({len(cart_new)}건" + (f", 이미 수강 중 {skipped}건 제외)" if skipped else ")"))
+                                time.sleep(1.5); st.rerun()
                             
                         if col_n.button("취소", use_container_width=True):
                             st.session_state.confirm_save_cart = False
@@ -844,16 +2921,13 @@ elif menu == "4. 수강 배정":
                 if sel_student_label:
                     st.markdown("---")
                     st.markdown("#### 📋 현재 수강 중인 수업")
-                    real_name_curr = sel_student_label.split(' (')[0]
+                    real_name_curr = real_name
                     
                     if not df_e.empty:
                         try:
-                            curr_list = df_e[df_e.iloc[:,0] == real_name_curr]
+                            curr_list = df_e[df_e['학생'] == real_name_curr]
                             if not curr_list.empty:
-                                for idx, row in curr_list.iterrows():
-                                    subj_val = row.iloc[1]
-                                    cls_val = row.iloc[2]
-                                    tea_val = row.iloc[3]
+                                for subj_val, cls_val, tea_val in zip(curr_list['과목'], curr_list['반이름'], curr_list['담당강사']):
                                     
                                     unique_key = f"{real_name_curr}_{cls_val}_{subj_val}"
                                     c1, c2 = st.columns([4, 1])
@@ -884,13 +2958,14 @@ elif menu == "4. 수강 배정":
 # ==========================================
 # 5. 출석 체크
 # ==========================================
-elif menu == "5. 출석 체크":
+elif menu == "5. 출석 관리":
     st.subheader("✅ 수동 출석 체크")
-    df_e = load_data('enrollments')
+    df_e = load_typed(['enrollments'])['enrollments']
     if not df_e.empty:
         td = st.date_input("날짜")
-        cls = st.selectbox("반 선택", df_e.iloc[:,1].unique())
-        stds = sorted(list(set(df_e[df_e.iloc[:,1] == cls].iloc[:,0].tolist())))
+        e_cls, e_std = df_e['반이름'], df_e['학생']
+        cls = st.selectbox("반 선택", e_cls.unique().tolist())
+        stds = sorted(list(set(e_std[e_cls == cls].tolist())))
         with st.form("att_form"):
             st.write(f"**{cls}** 수강생 ({len(stds)}명)")
             res = {}; cols = st.columns(4)
@@ -898,94 +2973,94 @@ elif menu == "5. 출석 체크":
                 with cols[i%4]: res[s] = "출석" if st.checkbox(s, value=True) else "결석"
             memo = st.text_input("특이사항")
             if st.form_submit_button("출석 저장"):
-                for s, v in res.items():
-                    add_data('attendance', {'날짜': str(td), '반이름': cls, '학생': s, '상태': v, '비고': memo})
-                show_center_message("출석 저장 완료!")
+                # 반 전체를 한 번에 저장 (같은 날짜/반/학생으로 다시 저장하면 기존 기록을 덮어씀)
+                rows = [{'날짜': str(td), '반이름': cls, '학생': s, '상태': v, '비고': memo} for s, v in res.items()]
+                if add_data_bulk('attendance', rows, upsert_keys=['날짜', '반이름', '학생']):
+                    show_center_message("출석 저장 완료!")
 
 # ==========================================
 # 6. 데이터 통합 조회
 # ==========================================
 elif menu == "6. 데이터 통합 조회":
     st.subheader("📊 데이터 통합 조회")
-    tabs = st.tabs(["강사", "학생", "반", "배정", "출석"])
-    tabs[0].dataframe(load_data('teachers'))
-    tabs[1].dataframe(load_data('students'))
-    tabs[2].dataframe(load_data('classes'))
-    tabs[3].dataframe(load_data('enrollments'))
-    tabs[4].dataframe(load_data('attendance'))
+    tabs = st.tabs(["강사", "학생", "반", "배정", "출석", "💾 스냅샷"])
+    snap = load_snapshot(['teachers', 'students', 'classes', 'enrollments', 'attendance'])
+    for tab, name in zip(tabs, snap): tab.dataframe(snap[name])
+
+    with tabs[-1]:
+        st.markdown("### 💾 전체 시트 스냅샷 내보내기")
+        st.caption("모든 시트를 한 번에 읽어 같은 시점의 사본을 시각별 폴더에 저장합니다. "
+                   "storage_backend를 snapshot으로 두면 앱이 가장 최근(또는 snapshot_path) 스냅샷을 읽기 전용으로 엽니다.")
+        ex1, ex2 = st.columns([1, 3])
+        ex_fmt = ex1.radio("형식", SNAPSHOT_FORMATS, format_func=lambda f: {"parquet": "Parquet (작은 용량)", "csv": "CSV (엑셀)"}[f], key="snap_fmt")
+        if ex2.button("📦 지금 스냅샷 만들기", type="primary"):
+            try:
+                with st.spinner("시트를 읽어서 저장하는 중..."):
+                    out_dir = export_snapshot(ex_fmt)
+                st.success(f"✅ 저장 완료: {out_dir}")
+            except Exception as e: st.error(f"스냅샷 저장 실패: {e}")
+
+        snapshots = list_snapshots()
+        if not snapshots: st.info("저장된 스냅샷이 없습니다.")
+        else:
+            st.dataframe(pd.DataFrame([{'폴더': os.path.basename(s['path']), '시각': s['created_at'], '원본': s['source'], '형식': s['format'],
+                                        **{n: info['rows'] for n, info in s['sheets'].items()}} for s in snapshots]),
+                         use_container_width=True, hide_index=True)
+            sel_snap = st.selectbox("내려받을 스냅샷", [s['path'] for s in snapshots], format_func=os.path.basename, key="snap_sel")
+            st.download_button("⬇️ ZIP으로 받기", data=snapshot_zip(sel_snap), file_name=f"형설지공_{os.path.basename(sel_snap)}.zip", mime="application/zip")
 
 # ==========================================
 # 7. 강사별 시간표
 # ==========================================
 elif menu == "7. 강사별 시간표":
     st.subheader("📅 강사별 주간 시간표")
-    df_c, df_t, df_e, df_s = load_data('classes'), load_data('teachers'), load_data('enrollments'), load_data('students')
+    snap = load_snapshot(['classes', 'teachers', 'enrollments', 'students'])
+    df_c, df_t, df_e, df_s = snap['classes'], snap['teachers'], snap['enrollments'], snap['students']
     
     if not df_t.empty and not df_c.empty:
         t_names = get_col_data(df_t, '이름', 0); t_subs = get_col_data(df_t, '과목', 1)
         days_ko = ["월", "화", "수", "목", "금", "토", "일"]
         
         tabs = st.tabs([f"{n} ({s})" for n, s in zip(t_names, t_subs)])
+        sched = get_schedule_index(df_c)
+        roster = get_roster_index(df_e, df_s)
+        sched_by_teacher = {t: g for t, g in sched.groupby('teacher', sort=False)}
         
         for idx, teacher_raw in enumerate(t_names):
             with tabs[idx]:
-                my_classes = df_c[df_c.iloc[:,1].str.contains(teacher_raw)]
-                local_times = set()
-                if not my_classes.empty:
-                    for _, row in my_classes.iterrows():
-                        for tp in str(row.iloc[2]).split(','):
-                            try: local_times.add(tp.split()[1].split('-')[0])
-                            except: pass
-                sorted_timeline = sort_time_strings(list(local_times))
+                my_sched = sched_by_teacher.get(str(teacher_raw).strip())
                 
-                if not sorted_timeline: st.info("수업 없음")
+                if my_sched is None: st.info("수업 없음")
                 else:
                     cols = st.columns([0.5] + [1]*7)
                     cols[0].write("")
                     for i, d in enumerate(days_ko): cols[i+1].markdown(f"<div class='day-header'>{d}</div>", unsafe_allow_html=True)
                     
-                    for start_t in sorted_timeline:
+                    for start_min, slot in my_sched.groupby('start_min'):
                         cols = st.columns([0.5] + [1]*7)
-                        max_end = start_t
-                        for _, row in my_classes.iterrows():
-                             for tp in str(row.iloc[2]).split(','):
-                                try:
-                                    s, e = tp.split()[1].split('-')
-                                    if s == start_t and e > max_end: max_end = e
-                                except: pass
+                        start_t = slot['start'].iloc[0]
+                        max_end = slot.loc[slot['end_min'].idxmax(), 'end']
+                        slot_by_day = {d: g for d, g in slot.groupby('day', sort=False)}
                         with cols[0]:
                             st.markdown(f"<div class='time-axis-card'><span class='tac-start'>{start_t}</span><span class='tac-tilde'>~</span><span class='tac-end'>{max_end}</span></div>", unsafe_allow_html=True)
                         for i, d in enumerate(days_ko):
                             found_list = []
-                            for _, row in my_classes.iterrows():
-                                for tp in str(row.iloc[2]).split(','):
-                                    if tp.strip().startswith(d):
-                                        try:
-                                            s, e = tp.split()[1].split('-')
-                                            if s == start_t:
-                                                found_list.append({
-                                                    'sub': t_subs.iloc[idx], 
-                                                    'name': row.iloc[0], 
-                                                    'room': row.iloc[3], 
-                                                    'time': tp.split()[1], 
-                                                    'dur': calc_duration_min(s, e)
-                                                })
-                                        except: pass
+                            if d in slot_by_day:
+                                for r in slot_by_day[d].itertuples():
+                                    found_list.append({
+                                        'sub': t_subs.iloc[idx], 
+                                        'name': r.class_name, 
+                                        'room': r.room, 
+                                        'time': f"{r.start}-{r.end}", 
+                                        'dur': r.dur
+                                    })
                             
                             with cols[i+1]:
                                 if found_list:
                                     sub_cols = st.columns(len(found_list))
                                     for si, found in enumerate(found_list):
                                         with sub_cols[si]:
-                                            detail_info = []
-                                            if not df_e.empty and not df_s.empty:
-                                                try:
-                                                    target_col_idx = 2
-                                                    std_names = df_e[df_e.iloc[:, target_col_idx] == found['name']].iloc[:,0].tolist()
-                                                    matched_std = df_s[df_s.iloc[:,0].isin(std_names)]
-                                                    for _, r in matched_std.iterrows():
-                                                        detail_info.append(f"• {r.iloc[0]} ({r.iloc[3]}, {r.iloc[4]})")
-                                                except: pass
+                                            detail_info = [f"• {n} ({g}, {sc})" for n, g, sc in roster.get(found['name'], [])]
                                             
                                             std_count = len(detail_info)
                                             
@@ -1005,79 +3080,55 @@ elif menu == "7. 강사별 시간표":
 # ==========================================
 elif menu == "8. 강의실별 시간표":
     st.subheader("🏫 강의실 배정 현황")
-    df_c, df_e, df_s = load_data('classes'), load_data('enrollments'), load_data('students')
+    snap = load_snapshot(['classes', 'enrollments', 'students'])
+    df_c, df_e, df_s = snap['classes'], snap['enrollments'], snap['students']
     
     if not df_c.empty:
         days_ko = ["월", "화", "수", "목", "금", "토", "일"]
         d_tabs = st.tabs(days_ko)
         rooms = ["기타", "101호", "102호", "103호", "104호"]
         
+        sched = get_schedule_index(df_c)
+        roster = get_roster_index(df_e, df_s)
+        sched_by_day = {d: g for d, g in sched.groupby('day', sort=False)}
+        
         for idx, day in enumerate(days_ko):
             with d_tabs[idx]:
-                day_times = set()
-                day_classes = []
-                for _, row in df_c.iterrows():
-                    for tp in str(row.iloc[2]).split(','):
-                        if tp.strip().startswith(day):
-                            try:
-                                t_range = tp.split()[1]
-                                day_times.add(t_range.split('-')[0])
-                                day_classes.append((row, t_range))
-                            except: pass
-                sorted_timeline = sort_time_strings(list(day_times))
+                day_sched = sched_by_day.get(day)
                 
-                if not sorted_timeline: st.info("수업 없음")
+                if day_sched is None: st.info("수업 없음")
                 else:
+                    day_sched = day_sched.assign(room=day_sched['room'].where(day_sched['room'].isin(rooms), "기타"))
                     cols = st.columns([0.3] + [1]*len(rooms))
                     cols[0].write("")
                     for i, r in enumerate(rooms): cols[i+1].markdown(f"<div class='day-header'>{r}</div>", unsafe_allow_html=True)
                     
-                    for start_t in sorted_timeline:
+                    for start_min, slot in day_sched.groupby('start_min'):
                         cols = st.columns([0.3] + [1]*len(rooms))
-                        max_end = start_t
-                        for r_data, t_str in day_classes:
-                            try:
-                                s, e = t_str.split('-')
-                                if s == start_t and e > max_end: max_end = e
-                            except: pass
+                        start_t = slot['start'].iloc[0]
+                        max_end = slot.loc[slot['end_min'].idxmax(), 'end']
+                        slot_by_room = {rm: g for rm, g in slot.groupby('room', sort=False)}
                         with cols[0]:
                             st.markdown(f"<div class='time-axis-card'><span class='tac-start'>{start_t}</span><span class='tac-tilde'>~</span><span class='tac-end'>{max_end}</span></div>", unsafe_allow_html=True)
                         
                         for i, r in enumerate(rooms):
                             found_list = []
-                            for r_data, t_str in day_classes:
-                                curr_r = str(r_data.iloc[3])
-                                if curr_r not in rooms: curr_r = "기타"
-                                if curr_r == r:
-                                    try:
-                                        s, e = t_str.split('-')
-                                        if s == start_t:
-                                            full_tea = str(r_data.iloc[1])
-                                            tn = full_tea.split('(')[0] if "(" in full_tea else full_tea
-                                            sub = full_tea.split('(')[1].replace(')', '') if "(" in full_tea else "과목"
-                                            found_list.append({
-                                                'sub': sub, 
-                                                'name': r_data.iloc[0], 
-                                                'tea': tn, 
-                                                'time': t_str, 
-                                                'dur': calc_duration_min(s, e)
-                                            })
-                                    except: pass
+                            if r in slot_by_room:
+                                for c in slot_by_room[r].itertuples():
+                                    found_list.append({
+                                        'sub': c.subject, 
+                                        'name': c.class_name, 
+                                        'tea': c.teacher, 
+                                        'time': f"{c.start}-{c.end}", 
+                                        'dur': c.dur
+                                    })
                             
                             with cols[i+1]:
                                 if found_list:
                                     sub_cols = st.columns(len(found_list))
                                     for si, found in enumerate(found_list):
                                         with sub_cols[si]:
-                                            detail_info = []
-                                            if not df_e.empty and not df_s.empty:
-                                                try:
-                                                    target_col_idx = 2
-                                                    std_names = df_e[df_e.iloc[:, target_col_idx] == found['name']].iloc[:,0].tolist()
-                                                    matched_std = df_s[df_s.iloc[:,0].isin(std_names)]
-                                                    for _, r in matched_std.iterrows():
-                                                        detail_info.append(f"• {r.iloc[0]} ({r.iloc[3]}, {r.iloc[4]})")
-                                                except: pass
+                                            detail_info = [f"• {n} ({g}, {sc})" for n, g, sc in roster.get(found['name'], [])]
 
                                             std_count = len(detail_info)
 
@@ -1097,43 +3148,40 @@ elif menu == "9. 학생 개인별 종합":
     
     st.subheader("📊 학생 개인별 종합 기록부")
     
-    df_s = load_data('students')
-    df_e = load_data('enrollments')
-    df_a = load_data('attendance')
+    # 출석은 전체를 받지 않고 아래에서 보는 달만 불러옴
+    snap = load_typed(['students', 'enrollments'])
+    df_s, df_e = snap['students'], snap['enrollments']
 
     if df_s.empty:
         st.warning("등록된 학생이 없습니다.")
     else:
-        df_s['L'] = df_s.iloc[:,0] + " (" + df_s.iloc[:,4] + ")"
-        s_list = df_s['L'].tolist()
+        s_list = df_s['_label'].tolist()
         s_sel = st.selectbox("학생을 선택하세요", s_list)
         
         if s_sel:
             real_name = s_sel.split(' (')[0]
-            s_info = df_s[df_s.iloc[:,0] == real_name].iloc[0]
+            s_info = df_s[df_s['이름'] == real_name].iloc[0]
             
             st.divider()
             
             col_p1, col_p2 = st.columns([1, 4])
             with col_p1:
-                qr_img = generate_styled_qr(f"{real_name}", real_name)
-                st.image(qr_img, width=130)
+                st.image(get_qr_card_png(qr_payload(real_name, s_info['연락처']), real_name), width=130)
             with col_p2:
-                st.markdown(f"### **{s_info.iloc[0]}**")
-                st.caption(f"🏫 {s_info.iloc[4]} ({s_info.iloc[3]}) | 📞 {s_info.iloc[1]}")
-                st.caption(f"👪 학부모: {s_info.iloc[2]}")
+                st.markdown(f"### **{s_info['이름']}**")
+                st.caption(f"🏫 {s_info['학교']} ({s_info['학년']}) | 📞 {s_info['연락처']}")
+                st.caption(f"👪 학부모: {s_info['학부모연락처']}")
 
             st.markdown("---")
 
             st.markdown("##### 📘 수강 및 배정 현황")
             if not df_e.empty:
                 try:
-                    my_classes = df_e[df_e.iloc[:,0] == real_name]
+                    my_classes = df_e[df_e['학생'] == real_name]
                     if my_classes.empty:
                         st.info("현재 수강 중인 수업이 없습니다.")
                     else:
-                        display_df = my_classes.iloc[:, [1, 2, 3]]
-                        display_df.columns = ["수강 과목", "수강 반", "담당 선생님"]
+                        display_df = my_classes[['과목', '반이름', '담당강사']].set_axis(["수강 과목", "수강 반", "담당 선생님"], axis=1)
                         st.dataframe(display_df, use_container_width=True, hide_index=True)
                 except:
                     st.error("데이터 구조를 불러오는 중입니다.")
@@ -1165,20 +3213,19 @@ elif menu == "9. 학생 개인별 종합":
                     st.rerun()
 
             att_map = {}
-            if not df_a.empty:
-                try:
-                    target_ym = f"{st.session_state.view_year}-{st.session_state.view_month:02d}"
-                    my_att = df_a[df_a.iloc[:,2] == real_name]
-                    month_data = my_att[my_att.iloc[:,0].astype(str).str.contains(target_ym)]
-                    
-                    for _, row in month_data.iterrows():
-                        d_str = str(row.iloc[0])
+            v_year, v_month = st.session_state.view_year, st.session_state.view_month
+            try:
+                # 해당 달 출석만 읽고, 학생별 인덱스에서 바로 꺼냄
+                month_data = get_partition_index('attendance', month_key(v_year, v_month), '학생').get(real_name)
+                if month_data is not None:
+                    for d_str, status in zip(get_col_data(month_data, '날짜', 0).astype(str), get_col_data(month_data, '상태', 3)):
                         day_int = int(d_str.split('-')[2])
-                        status = row.iloc[3]
-                        
                         if day_int not in att_map: att_map[day_int] = []
                         att_map[day_int].append(status)
-                except: pass
+            except: pass
+            # ◀/▶ 이동에 대비해 앞뒤 달을 미리 읽어둠
+            prefetch_partitions('attendance', [month_key(v_year, v_month, d)
+                                               for d in range(-PARTITION_PREFETCH, PARTITION_PREFETCH + 1) if d])
 
             d_cols = st.columns(7)
             days_ko = ["월", "화", "수", "목", "금", "토", "일"]
@@ -1221,37 +3268,96 @@ elif menu == "9. 학생 개인별 종합":
 elif menu == "10. QR 키오스크(출석)":
     st.empty(); st.markdown("""<style>.block-container{padding-top:2rem;} h1{text-align:center;color:#1565C0;}</style>""", unsafe_allow_html=True)
     st.title("📷 형설지공 학원 출석 키오스크"); st.write("카메라에 QR코드를 비춰주세요.")
+    if get_backend().get('read_only'):
+        # 스냅샷은 쓰기가 안 되므로 스캔을 받지 않음 (출석됐다고 안내하고 기록이 사라지는 일 방지)
+        st.error("읽기 전용 스냅샷으로 열려 있어 출석을 기록할 수 없습니다. (storage_backend 설정 확인)")
+        st.stop()
     img_file_buffer = st.camera_input("QR 스캔", label_visibility="hidden")
     if img_file_buffer:
         decoded_text = decode_qr(img_file_buffer)
         if decoded_text:
             try:
-                s_name, s_phone4 = decoded_text.split('/')
-                df_s, df_e, df_c = load_data('students'), load_data('enrollments'), load_data('classes')
-                student_row = df_s[df_s['이름'] == s_name]
-                if student_row.empty: st.error("등록되지 않은 학생입니다.")
+                payload = decoded_text.strip()
+                replay = get_recent_scan(payload)
+                if replay:
+                    # 같은 QR이 방금 처리됨 -> 저장 없이 이전 응답만 다시 보여줌
+                    getattr(st, replay[0])(replay[1])
                 else:
-                    now = datetime.now(); today_weekday = ["월", "화", "수", "목", "금", "토", "일"][now.weekday()]; current_time_str = now.strftime("%H:%M")
-                    my_classes = df_e[df_e.iloc[:,0] == s_name]; found_class_today = False
-                    if not my_classes.empty:
-                        for _, row in my_classes.iterrows():
-                            c_name = row.iloc[1]; c_info = df_c[df_c.iloc[:,0] == c_name]
-                            if not c_info.empty:
-                                schedule_str = str(c_info.iloc[0, 2])
-                                if today_weekday in schedule_str:
-                                    for part in schedule_str.split(','):
-                                        if part.strip().startswith(today_weekday):
-                                            t_range = part.strip().split()[1]; start_time_str = t_range.split('-')[0]
-                                            s_time = datetime.strptime(start_time_str, "%H:%M"); s_time = now.replace(hour=s_time.hour, minute=s_time.minute, second=0)
-                                            status = "출석"; msg = f"{s_name} 학생, 환영합니다! (수업: {c_name})"; limit_time = s_time + timedelta(minutes=10)
-                                            if now > limit_time: status = "지각"; msg = f"🚨 {s_name} 학생, 지각입니다! (수업: {c_name})"
-                                            elif now < (s_time - timedelta(minutes=60)): status = "보강/자습"; msg = f"{s_name} 학생, 일찍 왔네요! 자습하세요."
-                                            add_data('attendance', {'날짜': str(now.date()), '반이름': c_name, '학생': s_name, '상태': status, '비고': f"QR체크({current_time_str})"})
-                                            if status == "지각": st.error(msg)
-                                            else: st.success(msg)
-                                            found_class_today = True; break
-                    if not found_class_today:
-                        st.info(f"{s_name} 학생, 오늘은 정규 수업이 없습니다."); 
-                        if st.button("보강 출석 확인"): add_data('attendance', {'날짜': str(now.date()), '반이름': "보강/자습", '학생': s_name, '상태': "보강", '비고': f"QR체크({current_time_str})"}); st.success("보강 출석 처리되었습니다.")
+                    snap = load_snapshot(['students', 'enrollments', 'classes', 'attendance'])
+                    kiosk_idx = get_kiosk_index(snap['students'], snap['enrollments'], snap['classes'])
+                    now = datetime.now(); current_time_str = now.strftime("%H:%M")
+                    student, session = kiosk_lookup(kiosk_idx, payload, now)
+                    if student is None: st.error("등록되지 않은 학생입니다.")
+                    else:
+                        s_name = student['name']
+                        if session:
+                            start_min, _, c_name = session
+                            s_time = now.replace(hour=start_min // 60, minute=start_min % 60, second=0)
+                            status = "출석"; msg = f"{s_name} 학생, 환영합니다! (수업: {c_name})"; limit_time = s_time + timedelta(minutes=10)
+                            if now > limit_time: status = "지각"; msg = f"🚨 {s_name} 학생, 지각입니다! (수업: {c_name})"
+                            elif now < (s_time - timedelta(minutes=60)): status = "보강/자습"; msg = f"{s_name} 학생, 일찍 왔네요! 자습하세요."
+                            record = {'날짜': str(now.date()), '반이름': c_name, '학생': s_name, '상태': status, '비고': f"QR체크({current_time_str})"}
+                            if is_attendance_recorded(record, snap['attendance']): response = ("info", f"{s_name} 학생은 이미 출석 처리되었습니다. (수업: {c_name})")
+                            else:
+                                enqueue_attendance(record)
+                                response = ("error", msg) if status == "지각" else ("success", msg)
+                            remember_scan(payload, response)
+                            getattr(st, response[0])(response[1])
+                        else:
+                            st.info(f"{s_name} 학생, 오늘은 정규 수업이 없습니다."); 
+                            if st.button("보강 출석 확인"):
+                                record = {'날짜': str(now.date()), '반이름': "보강/자습", '학생': s_name, '상태': "보강", '비고': f"QR체크({current_time_str})"}
+                                if not is_attendance_recorded(record, snap['attendance']): enqueue_attendance(record)
+                                remember_scan(payload, ("success", "보강 출석 처리되었습니다."))
+                                st.success("보강 출석 처리되었습니다.")
             except: st.error("QR 오류")
-        else: st.warning("QR 인식 실패")
\ No newline at end of file
+        else: st.warning("QR 인식 실패")
+
+    with st.expander("🔬 QR 인식 성능"):
+        qr_stats, qr_hits = get_qr_timing_stats()
+        if qr_stats.empty: st.caption("아직 측정된 스캔이 없습니다.")
+        else:
+            st.dataframe(qr_stats, hide_index=True, use_container_width=True)
+            st.caption(f"인식 단계: ROI {qr_hits['roi']}회 · 축소 {qr_hits['pyramid']}회 · 원본 {qr_hits['full']}회 · 실패 {qr_hits['miss']}회")
+        sample_dir = get_config("qr_sample_dir", "qr_samples")
+        if os.path.isdir(sample_dir) and st.button("샘플 프레임으로 측정"):
+            paths = sorted(os.path.join(sample_dir, f) for f in os.listdir(sample_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+            st.dataframe(benchmark_qr_decoder(paths), hide_index=True, use_container_width=True)
+
+    q_depth = get_queue_depth()
+    if q_depth:
+        st.caption(f"⏳ 전송 대기 중인 출석 기록: {q_depth}건")
+        if get_attendance_queue()['last_error']: st.caption(f"⚠️ 마지막 전송 오류: {get_attendance_queue()['last_error']}")
+
+# ==========================================
+# 11. 출석 통계
+# ==========================================
+elif menu == "11. 출석 통계":
+    st.subheader("📈 출석 통계")
+    snap = load_snapshot(['attendance', 'classes', 'students'])
+    summary = get_attendance_summary(snap['attendance'])
+
+    if summary.empty:
+        st.info("출석 기록이 없습니다.")
+    else:
+        months = sorted(summary['월'].unique(), reverse=True)
+        c_f1, c_f2 = st.columns([1, 2])
+        period = c_f1.selectbox("기간", ["전체 기간"] + months)
+        group_by = c_f2.radio("기준", ["반별", "강사별", "학년별"], horizontal=True)
+
+        data = summary if period == "전체 기간" else summary[summary['월'] == period]
+        data = attach_attendance_dims(data, snap['classes'], snap['students'])
+
+        total = data['횟수'].sum()
+        present = data.loc[data['상태'].isin(ATTENDANCE_PRESENT), '횟수'].sum()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("전체 기록", f"{total}건")
+        c2.metric("출석률", f"{present / total * 100:.1f}%" if total else "-")
+        c3.metric("지각", f"{data.loc[data['상태'] == '지각', '횟수'].sum()}회")
+        c4.metric("결석", f"{data.loc[data['상태'] == '결석', '횟수'].sum()}회")
+
+        st.divider()
+        group_col = {"반별": '반이름', "강사별": '강사', "학년별": '학년'}[group_by]
+        rates = build_attendance_rates(data, group_col)
+        st.bar_chart(rates['출석률(%)'])
+        st.dataframe(rates, use_container_width=True)
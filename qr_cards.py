@@ -0,0 +1,83 @@
+"""
+QR 출석 카드 렌더링 (streamlit 없이 동작 -> 일괄 발급 시 프로세스 풀 워커에서도 사용)
+"""
+import io
+import os
+import zipfile
+import functools
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+# 카드 스타일 (캐시 키에 들어가므로 해시 가능한 튜플로 유지)
+DEFAULT_STYLE = (("title", "형설지공 학원"), ("box_size", 10), ("border", 2))
+
+A4_PX = (1240, 1754) # A4 @ 150dpi
+A4_DPI = 150
+A4_GRID = (3, 4) # 가로 3장 x 세로 4장
+A4_MARGIN = 60
+
+@functools.lru_cache(maxsize=None)
+def load_fonts():
+    # 폰트 파일은 프로세스당 한 번만 읽음 (제목용, 이름용)
+    font_path = "font.ttf" if os.path.exists("font.ttf") else "/System/Library/Fonts/Supplemental/AppleGothic.ttf"
+    try:
+        return ImageFont.truetype(font_path, 30), ImageFont.truetype(font_path, 35)
+    except:
+        return ImageFont.load_default(), ImageFont.load_default()
+
+def render_card(payload, student_name, style=DEFAULT_STYLE):
+    opts = dict(style)
+    qr = qrcode.QRCode(version=1, box_size=opts["box_size"], border=opts["border"])
+    qr.add_data(payload); qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+    top_p, bot_p = 60, 60
+    canvas_w, canvas_h = qr_img.width + 40, qr_img.height + top_p + bot_p
+    canvas = Image.new("RGB", (canvas_w, canvas_h), "white")
+    canvas.paste(qr_img, ((canvas_w - qr_img.width) // 2, top_p))
+    draw = ImageDraw.Draw(canvas)
+
+    fh, fn = load_fonts()
+    title = opts["title"]
+    draw.text(((canvas_w - draw.textlength(title, font=fh)) / 2, 15), title, fill="black", font=fh)
+    draw.text(((canvas_w - draw.textlength(student_name, font=fn)) / 2, canvas_h - 50), student_name, fill="black", font=fn)
+    return canvas
+
+def render_card_png(job):
+    """
+    job: (payload, 학생 이름, 스타일) -> PNG bytes (프로세스 풀 map용)
+    """
+    payload, student_name, style = job
+    buf = io.BytesIO()
+    render_card(payload, student_name, style).save(buf, format="PNG")
+    return buf.getvalue()
+
+def tile_a4_pdf(png_list):
+    """
+    카드 PNG들을 A4 페이지에 격자로 배치한 여러 장짜리 PDF
+    """
+    cols, rows = A4_GRID
+    cell_w = (A4_PX[0] - A4_MARGIN * 2) // cols
+    cell_h = (A4_PX[1] - A4_MARGIN * 2) // rows
+    pages = []
+    for i, png in enumerate(png_list):
+        if i % (cols * rows) == 0:
+            pages.append(Image.new("RGB", A4_PX, "white"))
+        card = Image.open(io.BytesIO(png)).convert("RGB")
+        card.thumbnail((cell_w - 20, cell_h - 20))
+        slot = i % (cols * rows)
+        x = A4_MARGIN + (slot % cols) * cell_w + (cell_w - card.width) // 2
+        y = A4_MARGIN + (slot // cols) * cell_h + (cell_h - card.height) // 2
+        pages[-1].paste(card, (x, y))
+    if not pages: return b""
+    buf = io.BytesIO()
+    pages[0].save(buf, format="PDF", save_all=True, append_images=pages[1:], resolution=A4_DPI)
+    return buf.getvalue()
+
+def zip_pngs(named_pngs):
+    """
+    [(파일명, PNG bytes), ...] -> ZIP bytes
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for file_name, png in named_pngs: zf.writestr(file_name, png)
+    return buf.getvalue()